@@ -10,11 +10,30 @@ import os
 import sys
 
 from datetime import datetime
+from time import time
 
 import json, requests
 
 import sense_energy
 from sense_energy.sense_exceptions import *
+from registry import DeviceRegistry
+
+# Shortest time between two cycles in push mode
+PUSH_MIN_GAP = 0.25
+
+# Numeric settings: (type, smallest allowed, default)
+NUMBER_PREFS = {
+	"changeThreshold": (int, 0, 0),
+	"changePercent": (float, 0, 0),
+	"minInterval": (int, 0, 0),
+	"heartbeat": (int, 0, 600),
+	"maxWriteRate": (float, 0, 1),
+	"pollFloor": (int, 1, 5),
+	"pollCeiling": (int, 1, 120),
+	"apiBudget": (int, 0, 0),
+}
+# The ones each device can override, blank to use the plugin setting
+DEVICE_PREFS = ("changeThreshold", "changePercent", "minInterval")
 
 # Note the "indigo" module is automatically imported and made available inside
 # our global name space by the host process.
@@ -28,14 +47,23 @@ class Plugin(indigo.PluginBase):
 
 		self.rateLimit = pluginPrefs.get("rateLimit", 30)
 		self.doSolar = bool(pluginPrefs.get("solarEnabled", False))
+		self.averagePower = bool(pluginPrefs.get("averagePower", False))
+		self.setDeadband(pluginPrefs)
+		self.setPush(pluginPrefs)
+		self.setScheduler(pluginPrefs)
 		self.folderID = pluginPrefs.get("folderID", None)
 
-		self.devIDs = list()
-
-		self.sidFromDev = dict()
-		self.devFromSid = dict()
+		self.devices = DeviceRegistry() #Our Indigo devices, by key and by Indigo ID
+		self.reconciled = dict() #Catalog version, registry version and solar setting last reconciled, by monitor
+		self.tracked = dict() #Registry entries of devices to update, by monitor then sID
+		self.lastRt = dict() #Previous reading processed, by monitor
+		self.pending = dict() #sIDs whose reading differs from what the deadband let through, by monitor
 
 		self.rt  = dict() #RealTime
+		self.seenSeq = dict() #Realtime update last processed, by monitor
+		self.seenUpdates = 0 #Realtime updates counted by the last push cycle
+		self.fullAt = 0 #Time every monitor was last updated
+		self.csvAt = 0 #Time the CSV was last written
 
 		self.dontStart = True
 
@@ -43,6 +71,7 @@ class Plugin(indigo.PluginBase):
 
 		self.csvActive = "{}/Preferences/Plugins/{}/activeLog.csv".format(indigo.server.getInstallFolderPath(), self.pluginId)
 		self.csvDaily = "{}/Preferences/Plugins/{}/dailyLog.csv".format(indigo.server.getInstallFolderPath(), self.pluginId)
+		self.tokenCache = sense_energy.TokenCache("{}/Preferences/Plugins/{}/token.json".format(indigo.server.getInstallFolderPath(), self.pluginId))
 
 		if not os.path.exists(self.csvPath):
 			os.mkdir(self.csvPath)
@@ -50,17 +79,56 @@ class Plugin(indigo.PluginBase):
 			csv_file.write("Timestamp,power\n")
 			csv_file.close()
 
+	def checkNumbers(self, valuesDict, names, blankAllowed):
+		#Returns an errorDict for the fields that aren't valid numbers, None if they all are
+		errorDict = indigo.Dict()
+		for name in names:
+			cast, minimum, default = NUMBER_PREFS[name]
+			value = valuesDict.get(name, "")
+			if (blankAllowed and value == ""):
+				continue
+			try:
+				if (cast(value) < minimum):
+					raise ValueError(value)
+			except ValueError:
+				if (cast == int):
+					errorDict[name] = "This field should contain a whole number of at least {}".format(minimum)
+				else:
+					errorDict[name] = "This field should contain a number of at least {}".format(minimum)
+		if (len(errorDict) == 0):
+			return None
+		return errorDict
+
 	def validatePrefsConfigUi(self, valuesDict):
-		fid = int(valuesDict["folderID"])
-		if (fid in indigo.devices.folders):
+		#Blank numbers take their default
+		errorDict = self.checkNumbers(valuesDict, NUMBER_PREFS.keys(), blankAllowed=True)
+		if (errorDict is None and self.prefNumber(valuesDict, "pollCeiling") < self.prefNumber(valuesDict, "pollFloor")):
+			errorDict = indigo.Dict()
+			errorDict["pollCeiling"] = "The longest poll interval can't be shorter than the shortest"
+		if (errorDict is not None):
+			return (False, valuesDict, errorDict)
+		fid = valuesDict["folderID"]
+		try:
+			fid = int(fid)
+		except ValueError:
+			#A folder name isn't accepted, devices are created with int(self.folderID)
+			fid = None
+		if (fid is not None and fid in indigo.devices.folders):
 			return True
 		else:
 			errorDict = indigo.Dict()
 			errorDict["folderID"] = "This field should contain a folder ID"
-			errorDict["showAlertText"] = "Folder not found with ID: %s \n\nEnsure you have used the ID, not the name of the folder.\n\nRight-click the folder you want to use and use 'Copy ID' to obtain the correct ID." % fid
+			errorDict["showAlertText"] = "Folder not found with ID: %s \n\nEnsure you have used the ID, not the name of the folder.\n\nRight-click the folder you want to use and use 'Copy ID' to obtain the correct ID." % valuesDict["folderID"]
 			return (False, valuesDict, errorDict)
 
 
+	def validateDeviceConfigUi(self, valuesDict, typeId, devId):
+		#Blank numbers use the plugin setting
+		errorDict = self.checkNumbers(valuesDict, DEVICE_PREFS, blankAllowed=True)
+		if (errorDict is not None):
+			return (False, valuesDict, errorDict)
+		return True
+
 	def closedPrefsConfigUi(self, valuesDict, userCancelled):
 		# Since the dialog closed we want to set the debug flag - if you don't directly use
 		# a plugin's properties (and for debugLog we don't) you'll want to translate it to
@@ -72,30 +140,39 @@ class Plugin(indigo.PluginBase):
 			else:
 				indigo.server.log("Debug logging disabled")
 			self.rateLimit = int(valuesDict.get("rateLimit", 30))
-			self.debugLog(self.sense.authenticate(str(valuesDict['username']), str(valuesDict['password']), self.rateLimit))
+			self.debugLog(self.sense.authenticate(str(valuesDict['username']), str(valuesDict['password']), self.rateLimit, self.tokenCache))
 			self.doSolar = bool(valuesDict.get("solarEnabled", False))
+			self.averagePower = bool(valuesDict.get("averagePower", False))
+			self.setDeadband(valuesDict)
+			self.setPush(valuesDict)
+			self.setScheduler(valuesDict)
 			self.folderID = valuesDict.get("folderID", "")
+			self.setAggregation()
 
 			self.createCore()
 
 			if (self.dontStart == False):
 				self.getDevices()
 
-	def createCore(self):
+	def deviceKey(self, monitorID, sID):
+		#Devices of the primary monitor keep their bare Sense ID, so existing devices carry on working
+		if (monitorID == self.sense.sense_monitor_id):
+			return sID
+		return "{}:{}".format(monitorID, sID)
+
+	def createCore(self, monitorID=None):
 		try:
 			self.debugLog("CreateCore")
-			dev = indigo.device.create(indigo.kProtocol.Plugin,"Active Total","Active Total",deviceTypeId="sensedevice",folder=int(self.folderID))
-			dev.updateStateOnServer(key='id', value='core')
-			dev.updateStateOnServer(key='power', value="0", uiValue="0 w")
-			dev.updateStateImageOnServer(indigo.kStateImageSel.PowerOff)
+			monitorID = monitorID or self.sense.sense_monitor_id
+			sID = self.deviceKey(monitorID, "core")
+			dName = "Active Total"
+			if (sID != "core"):
+				dName = "Active Total {}".format(monitorID)
+			dev = indigo.device.create(indigo.kProtocol.Plugin,dName,dName,deviceTypeId="sensedevice",folder=int(self.folderID))
+			entry = self.devices.add(sID, dev.id, dev)
+			dev.updateStatesOnServer([{'key': 'id', 'value': sID}, {'key': 'monitor', 'value': str(monitorID)}] + self.powerStates(0))
+			self.updateImage(entry, False)
 			dev.stateListOrDisplayStateIdChanged()
-
-			#Add it to self.devIDs
-			devID = dev.id
-			sID = "core"
-			self.devIDs.append(sID)
-			self.sidFromDev[int(devID)] = sID
-			self.devFromSid[sID] = devID
 		except ValueError as e:
 			self.errorLog("Could not create Core device.")
 			pass
@@ -105,13 +182,90 @@ class Plugin(indigo.PluginBase):
 		self.debugLog(u"startup called")
 		#self.debugLog(u"Creating senseable")
 		self.sense = sense_energy.Senseable()
+		self.sense.lazy_trends = True
 		self.debugLog(u"Authenticating...")
-		self.debugLog(self.sense.authenticate(str(self.pluginPrefs['username']), str(self.pluginPrefs['password']), self.rateLimit))
+		self.debugLog(self.sense.authenticate(str(self.pluginPrefs['username']), str(self.pluginPrefs['password']), self.rateLimit, self.tokenCache))
+		#One login serves every monitor on the account, each with its own stream and device list
+		self.debugLog(u"Monitors: {}".format(", ".join(str(m) for m in self.sense.sense_monitors)))
+		for monitorID in self.sense.sense_monitors:
+			self.sense.get_catalog(monitorID).add_listener(self.catalogChanged)
+		self.setAggregation()
+		self.debugLog(u"Opening realtime streams...")
+		self.sense.start_realtime()
 		#for dev in indigo.devices.iter("self"):
 			#indigo.device.delete(dev)
 
+	def catalogChanged(self, catalog):
+		self.debugLog(u"Sense device list changed ({} devices, version {})".format(len(catalog.devices), catalog.version))
+
+	def prefNumber(self, values, name):
+		#Falls back to the default for values saved before they were validated
+		cast, minimum, default = NUMBER_PREFS[name]
+		value = values.get(name, default)
+		if (value == ""):
+			return default
+		try:
+			value = cast(value)
+		except ValueError:
+			value = minimum - 1
+		if (value < minimum):
+			self.errorLog(u"Ignoring invalid {}: {}".format(name, values.get(name)))
+			return default
+		return value
+
+	def setDeadband(self, values):
+		#Global deadband, devices can override all but the heartbeat in their own config
+		self.deadband = sense_energy.Deadband(watts=self.prefNumber(values, "changeThreshold"), percent=self.prefNumber(values, "changePercent"), min_interval=self.prefNumber(values, "minInterval"), heartbeat=self.prefNumber(values, "heartbeat"))
+
+	def setPush(self, values):
+		#Push mode updates Indigo as realtime updates arrive instead of every rateLimit seconds
+		self.pushUpdates = bool(values.get("pushUpdates", False))
+		#No device is written more often than this, in either mode
+		rate = self.prefNumber(values, "maxWriteRate")
+		self.minWriteGap = 1.0 / rate if rate > 0 else 0
+
+	def setScheduler(self, values):
+		#Adaptive polling shortens the interval while the house is busy and stretches it while idle
+		self.adaptivePoll = bool(values.get("adaptivePoll", False))
+		budget = self.prefNumber(values, "apiBudget")
+		self.scheduler = sense_energy.PollScheduler(floor=self.prefNumber(values, "pollFloor"), ceiling=self.prefNumber(values, "pollCeiling"), budget=budget or None)
+
+	def deviceDeadband(self, dev):
+		props = dev.pluginProps
+		def prop(name, cast):
+			value = props.get(name, "")
+			if (value == ""):
+				return None
+			try:
+				return cast(value)
+			except ValueError:
+				self.errorLog(u"Ignoring invalid {} for {}: {}".format(name, dev.name, value))
+				return None
+		return dict(watts=prop("changeThreshold", int), percent=prop("changePercent", float), min_interval=prop("minInterval", int))
+
+	def shouldPublish(self, entry, power):
+		#power is None for a device that is "Off"
+		deadband = self.deadband
+		if (entry.deadband):
+			deadband = deadband.override(**entry.deadband)
+		elapsed = None if entry.publishedAt is None else time() - entry.publishedAt
+		if (elapsed is not None and elapsed < self.minWriteGap):
+			return False
+		return deadband.allows(entry.published, power, elapsed)
+
+	def setAggregation(self):
+		if (self.averagePower):
+			#Average every realtime update since the last refresh, dropping old ones only if refreshes stall
+			interval = int(self.rateLimit)
+			if (self.adaptivePoll):
+				interval = max(interval, self.scheduler.ceiling)
+			self.sense.enable_aggregation(window=2 * interval)
+		else:
+			self.sense.disable_aggregation()
+
 	def shutdown(self):
 		self.debugLog(u"shutdown called")
+		self.sense.stop_realtime()
 
 	def deviceStartComm(self, dev):
 		#self.debugLog("deviceStartComm called")
@@ -121,13 +275,20 @@ class Plugin(indigo.PluginBase):
 			devID = dev.id
 			dName = dev.name
 			sID = dev.states['id']
-			if (sID != ""): #The state doesn't exist when the device is first created, so can't populate self.devIDs at this point
-				self.devIDs.append(sID)
-				self.sidFromDev[int(devID)] = sID
-				self.devFromSid[sID] = devID
+			if (sID != ""): #The state doesn't exist when the device is first created, so can't register it at this point
+				if (not dev.states.get('monitor', "")):
+					#Devices created before monitor tagging, only the primary monitor's lack a prefix
+					dev.refreshFromServer() #Picks up the states added by stateListOrDisplayStateIdChanged
+					monitorID = sID.split(":", 1)[0] if (":" in sID) else getattr(self.sense, 'sense_monitor_id', "")
+					if (monitorID != ""):
+						dev.updateStateOnServer(key='monitor', value=str(monitorID))
+				entry = self.devices.add(sID, devID, dev)
+				override = self.deviceDeadband(dev)
+				if (any(v is not None for v in override.values())):
+					entry.deadband = override
 			#self.debugLog("Added device {} ({})".format(sID,dName)
 			#self.debugLog(dev.states)
-			#self.debugLog(str(self.devIDs))
+			#self.debugLog(str(len(self.devices)))
 
 	def deviceStopComm(self, dev):
 		#self.debugLog("deviceStopComm called")
@@ -135,128 +296,247 @@ class Plugin(indigo.PluginBase):
 			devID = dev.id
 			sID = dev.states['id']
 			dName = dev.name
-			try:
-				self.devIDs.remove(sID)
-			except:
-				pass
-			self.sidFromDev.pop(int(devID),None)
-			self.devFromSid.pop(sID,None)
+			self.devices.removeDev(devID)
 			#self.debugLog("Removed device {} ({})".format(sID,dName))
 
-	def getDevices(self):
-		#self.debugLog("IDs: %s" % self.devIDs)
-		self.debugLog(u"Getting realtime()")
-		try:
-			#self.debugLog(u"132")
-			self.sense.update_realtime()
-			#self.debugLog(u"134")
-			for i in self.sense._realtime['devices']:
-				#self.debugLog(i)
-				rtid = i['id'] #Get ID from RealTime devices
-				self.rt[rtid] = int(i['w']) #Get power from RealTime devices
-			#self.debugLog(u"138")
-		except SenseAPITimeoutException as e:
-			self.errorLog(e)
+	def deviceUpdated(self, origDev, newDev):
+		super(Plugin, self).deviceUpdated(origDev, newDev)
+		#Keep the cached copy current when a device is changed in Indigo
+		if (newDev.pluginId == self.pluginId):
+			self.devices.refresh(newDev)
+
+	def getDevices(self, changedOnly=False):
+		#self.debugLog("Devices: %s" % len(self.devices))
+		if (not changedOnly):
+			self.fullAt = time()
+		for monitorID in self.sense.sense_monitors:
+			#Several realtime updates since the last cycle are coalesced into the latest
+			if (changedOnly and self.sense.get_realtime_snapshot(monitorID).seq == self.seenSeq.get(monitorID)):
+				continue
+			self.updateMonitor(monitorID, not changedOnly)
+		if (self.adaptivePoll and not changedOnly):
+			#Activity across every monitor decides how soon the next poll comes
+			total = 0
+			power = dict()
+			for monitorID in self.sense.sense_monitors:
+				snapshot = self.sense.get_realtime_snapshot(monitorID)
+				total += snapshot.sample.w
+				power.update(((monitorID, sID), w) for sID, w in snapshot.device_power().items())
+			self.scheduler.observe(total, power)
+
+	def updateMonitor(self, monitorID, full=True):
+		#Only full cycles may wait on the Sense API, push mode runs one every rateLimit
+		primary = (monitorID == self.sense.sense_monitor_id)
+		# The realtime reader threads keep the snapshots current, so this never waits on the websocket
+		snapshot = self.sense.get_realtime_snapshot(monitorID)
+		if (snapshot.seq == 0):
+			self.debugLog(u"No realtime data received yet from monitor {}".format(monitorID))
+			if (not self.sense.realtime_running):
+				self.sense.start_realtime()
 			return
-		self.sense.update_trend_data()
-		active = self.sense.active_power
-		daily = self.sense.daily_usage
+		self.seenSeq[monitorID] = snapshot.seq
+		self.debugLog(u"Monitor {}: realtime update #{} ({:.1f}s old)".format(monitorID, snapshot.seq, snapshot.age))
+		if (snapshot.age > 2 * int(self.rateLimit)):
+			#The stream reconnects by itself, carry on with the last known values
+			self.debugLog(u"Realtime data is stale, stream is {}".format(self.sense.get_realtime_state(monitorID)))
+		self.rt = snapshot.device_power()
+		active = snapshot.sample.w
+		#The settings dialog may have switched averaging on without enabling aggregation yet
+		aggregator = self.sense.get_aggregator(monitorID) if self.averagePower else None
+		if (aggregator is not None):
+			window = aggregator.pop()
+			if (window.frames > 0):
+				self.debugLog(u"Averaged {} realtime updates".format(window.frames))
+				self.rt = dict((sID, int(round(p.mean))) for sID, p in window.devices.items() if p.mean > 0)
+				if ('w' in window.totals):
+					active = window.totals['w'].mean
 		self.debugLog("Active: {}w".format(active))
-		self.debugLog("Daily: {}kw".format(daily))
+		coreID = self.deviceKey(monitorID, "core")
 		try:
-			indigo.devices[self.devFromSid['core']].updateStateOnServer(key='power', value=str(int(active)), uiValue=str("{} w".format(int(active))))
-			indigo.devices[self.devFromSid['core']].updateStateImageOnServer(indigo.kStateImageSel.PowerOn)
+			entry = self.devices.byKey[coreID]
+			if (self.shouldPublish(entry, int(active))):
+				core = self.devices.device(coreID)
+				core.updateStatesOnServer(self.powerStates(int(active)))
+				self.updateImage(entry, True)
+				self.markPublished(entry, int(active))
 		except KeyError as e:
 			self.debugLog("No Core device found - Attempting to recreate.")
 			self.debugLog("Global Active and Daily stats will update on next refresh.")
 			self.debugLog(e)
-			self.createCore()
+			self.createCore(monitorID)
+
+		#Push mode still only logs once per rateLimit
+		if (primary and (not self.pushUpdates or time() - self.csvAt >= int(self.rateLimit))):
+			self.csvAt = time()
+			lastUpdateTS = snapshot.received
+			lastUpdate = datetime.fromtimestamp(lastUpdateTS).strftime("%Y-%m-%d %H:%M:%S.%f")
+			self.debugLog("CSV Output: {},{}".format(lastUpdate,int(active)))
+			csv_file = open(self.csvActive, 'a+')
+			csv_file.write('{0},{1}\n'.format(lastUpdate, int(active)))
+			csv_file.close()
+
+		#Device states go out before anything that may have to wait on the Sense API
+		written = self.publishTracked(monitorID, full)
 
-		lastUpdateTS = self.sense.getRealtimeCall()
-		lastUpdate = datetime.fromtimestamp(lastUpdateTS).strftime("%Y-%m-%d %H:%M:%S.%f")
-		self.debugLog("CSV Output: {},{}".format(lastUpdate,int(active)))
-		csv_file = open(self.csvActive, 'a+')
-		csv_file.write('{0},{1}\n'.format(lastUpdate, int(active)))
-		csv_file.close()
+		#Only asks Sense for the device list when it is due, or a realtime device isn't in it yet
+		catalog = self.sense.get_catalog(monitorID)
+		devices = catalog.update(self.rt) if full else catalog.devices
+		#Renames, merges, revocations and new devices can only appear with a new device list, or when our Indigo devices change
+		if (self.reconciled.get(monitorID) != (catalog.version, self.devices.version, self.doSolar)):
+			written += self.reconcile(monitorID, devices)
+			written += self.publishTracked(monitorID, True)
 
-		if (self.doSolar):
+		if (primary and full):
+			#Only refreshes DAY trend data, and only once it has expired
+			daily = self.sense.daily_usage
+			self.debugLog("Daily: {}kw".format(daily))
+
+		if (self.doSolar and primary and full):
 			self.debugLog("Active Solar {}w:".format(self.sense.active_solar_power))
 			self.debugLog("Daily Solar: {}kw".format(self.sense.daily_production))
 
-		for d in self.sense.get_discovered_device_data():
-			sID = d['id']
+		self.debugLog(u"{} devices written".format(written))
+		self.lastRt[monitorID] = self.rt
+		self.rt = None
+		self.rt = dict()
+		#self.debugLog("")
+
+	def publishTracked(self, monitorID, full):
+		tracked = self.tracked.get(monitorID, dict())
+		pending = self.pending.setdefault(monitorID, set())
+		if (full):
+			#Every device, for heartbeats
+			candidates = list(tracked.keys())
+		else:
+			#Only devices that changed since the last reading, or were held back by their deadband
+			delta = sense_energy.diff_device_power(self.lastRt.get(monitorID, dict()), self.rt)
+			candidates = set(delta.updates()) | pending
+		written = 0
+		for sID in candidates:
+			entry = tracked.get(sID)
+			if (entry is None):
+				pending.discard(sID)
+				continue
+			#Only devices that turned on, off or changed by more than their deadband need updating
+			if (self.shouldPublish(entry, self.rt.get(sID))):
+				self.publishPower(entry, sID)
+				written += 1
+			if (entry.published != self.rt.get(sID)):
+				pending.add(sID)
+			else:
+				pending.discard(sID)
+		return written
+
+	def reconcile(self, monitorID, devices):
+		#Brings our Indigo devices in line with a monitor's device list, returns how many were written
+		self.debugLog(u"Reconciling {} devices of monitor {}".format(len(devices), monitorID))
+		written = 0
+		tracked = dict() #Entry of every device getting power updates, by sID
+		retry = False
+		for d in devices:
+			sID = d.id
 			if ((not self.doSolar) and (sID == "solar")):
 				#self.debugLog("Solar disabled: skipping")
 				continue
-			dName = d['name']
-			dRevoked = False
-			if ('tags' in d) and ('Revoked' in d['tags']):
-				if (d['tags']['Revoked'] == 'true'):
-					dRevoked = True
-			if ('tags' in d) and ('UserDeleted' in d['tags']):
-				if (d['tags']['UserDeleted'] == 'true'):
-					dRevoked = True
-
-			if ('tags' in d) and ('MergedDevices' in d['tags']):
-				mergedDevices = d['tags']['MergedDevices'].split(',')
-				for md in mergedDevices:
-					if (md in self.devIDs):
-						self.debugLog(u"Deleting merged device: %s" % indigo.devices[self.devFromSid[md]].name)
-						indigo.device.delete(self.devFromSid[md])
+			dName = d.name
+			dRevoked = d.revoked
+			key = self.deviceKey(monitorID, sID)
 
+			for md in d.merged_ids:
+				mKey = self.deviceKey(monitorID, md)
+				if (mKey in self.devices):
+					self.debugLog(u"Deleting merged device: %s" % self.devices.device(mKey).name)
+					indigo.device.delete(self.devices.removeKey(mKey).devID)
+
+			entry = self.devices.get(key)
 			if (dRevoked):
-				if (sID in self.devIDs):
-					#indigo.device.delete(self.devFromSid[sID])
-					indigo.device.enable(self.devFromSid[sID], value=False)
+				if (entry):
+					#indigo.device.delete(entry.devID)
+					indigo.device.enable(entry.devID, value=False)
 			else:
-				if (sID in self.devIDs):
-					#self.debugLog("sID {} is in self.devIDs".format(sID))
-					dev = indigo.devices[self.devFromSid[sID]]
+				if (entry):
+					#self.debugLog("sID {} is registered".format(key))
+					dev = self.devices.device(key)
 					devOldName = dev.name
-					#self.debugLog("sID {} has old name {}".format(sID,devOldName))
-					#self.debugLog("sID {} has new name {}".format(sID,dName))
+					#self.debugLog("sID {} has old name {}".format(key,devOldName))
+					#self.debugLog("sID {} has new name {}".format(key,dName))
 					if (dev.name != dName):
 						dev.name = dName
 						try:
 							dev.replaceOnServer()
 						except ValueError as e:
+							dev.name = devOldName #Try again next time
+							retry = True
 							if (str(e) == "NameNotUniqueError"):
 								self.debugLog("Trying to rename %s to %s" % (devOldName,dName))
 								self.debugLog("Failed to rename - duplicate device found - please ensure Sense devices are all uniquely named")
 							else:
 								self.errorLog(e)
-					if (str(sID) in self.rt.keys()): #If the device is currently "On" (ie appearing in Realtime on Sense dashboard)
-						dev.updateStateOnServer(key='power', value=str(self.rt[sID]), uiValue=str("{} w".format(self.rt[sID])))
-						dev.updateStateImageOnServer(indigo.kStateImageSel.PowerOn)
-					else:
-						dev.updateStateOnServer(key='power', value="0", uiValue="0 w")
-						dev.updateStateImageOnServer(indigo.kStateImageSel.PowerOff)
+					tracked[sID] = entry
 					#dev.stateListOrDisplayStateIdChanged()
 				else:
-					#self.debugLog("sID {} is NOT in self.devIDs".format(sID))
-					self.debugLog("CREATING: {} ({})".format(dName,sID))
+					#self.debugLog("sID {} is NOT registered".format(key))
+					self.debugLog("CREATING: {} ({})".format(dName,key))
 					#self.debugLog(d)
 					try:
 						dev = indigo.device.create(indigo.kProtocol.Plugin,dName,dName,deviceTypeId="sensedevice",folder=int(self.folderID))
-						dev.updateStateOnServer(key='id', value=str(sID))
-						dev.updateStateOnServer(key='power', value="0", uiValue="0 w")
-						dev.updateStateImageOnServer(indigo.kStateImageSel.PowerOff)
+						entry = self.devices.add(key, dev.id, dev)
+						dev.updateStatesOnServer([{'key': 'id', 'value': str(key)}, {'key': 'monitor', 'value': str(monitorID)}] + self.powerStates(0))
+						self.updateImage(entry, False)
 						dev.stateListOrDisplayStateIdChanged()
-
-						#Add it to self.devIDs
-						devID = dev.id
-						self.devIDs.append(sID)
-						self.sidFromDev[int(devID)] = sID
-						self.devFromSid[sID] = devID
+						self.markPublished(entry, None)
+						if (sID in self.rt):
+							self.publishPower(entry, sID)
+						written += 1
+						tracked[sID] = entry
 					except ValueError as e:
 						if (str(e) == "NameNotUniqueError"):
 							self.debugLog("Duplicate device found - please ensure Sense devices are all uniquely named")
 						else:
 							self.errorLog(e)
 					#dev.stateListOrDisplayStateIdChanged()
-		self.rt = None
-		self.rt = dict()
-		#self.debugLog("")
+		self.tracked[monitorID] = tracked
+		if (retry):
+			self.reconciled.pop(monitorID, None)
+		else:
+			self.reconciled[monitorID] = (self.sense.get_catalog(monitorID).version, self.devices.version, self.doSolar)
+		return written
+
+	def publishPower(self, entry, sID):
+		#If the device is currently "On" (ie appearing in Realtime on Sense dashboard)
+		on = (sID in self.rt)
+		self.devices.device(entry.key).updateStatesOnServer(self.powerStates(self.rt[sID] if on else 0))
+		self.updateImage(entry, on)
+		self.markPublished(entry, self.rt.get(sID))
+
+	def markPublished(self, entry, power):
+		entry.published = power
+		entry.publishedAt = time()
+
+	def powerStates(self, power):
+		#Every state of a device goes to Indigo in one updateStatesOnServer call
+		return [{'key': 'power', 'value': str(power), 'uiValue': "{} w".format(power)}]
+
+	def updateImage(self, entry, on):
+		#The state image only needs sending when the device turns on or off
+		if (entry.imageOn != on):
+			dev = self.devices.device(entry.key)
+			if (on):
+				dev.updateStateImageOnServer(indigo.kStateImageSel.PowerOn)
+			else:
+				dev.updateStateImageOnServer(indigo.kStateImageSel.PowerOff)
+			entry.imageOn = on
+
+	def pushCycle(self):
+		#Wait for the realtime stream, a second at most so the thread can still be stopped
+		self.seenUpdates = self.sense.wait_realtime(self.seenUpdates, 1)
+		if (time() - self.fullAt >= int(self.rateLimit)):
+			#Every monitor, stalled ones included, still gets a full cycle every rateLimit
+			self.getDevices()
+		else:
+			self.getDevices(changedOnly=True)
+		#Updates arriving in the meantime are coalesced into the next cycle
+		self.sleep(PUSH_MIN_GAP)
 
 	def runConcurrentThread(self):
 		try:
@@ -266,8 +546,16 @@ class Plugin(indigo.PluginBase):
 					self.sleep(10) #Wait for initialisation to finish
 					self.dontStart = False
 
-				self.getDevices()
-				#self.debugLog(self.sense.getRealtimeCall())
-				self.sleep(int(self.rateLimit))
+				if (self.pushUpdates):
+					self.pushCycle()
+				elif (self.adaptivePoll):
+					self.getDevices()
+					interval = self.scheduler.next_interval(self.sense.api_calls)
+					self.debugLog(u"Next poll in {:.1f}s ({} API calls in the last hour)".format(interval, self.scheduler.calls_per_hour()))
+					self.sleep(interval)
+				else:
+					self.getDevices()
+					#self.debugLog(self.sense.getRealtimeCall())
+					self.sleep(int(self.rateLimit))
 		except self.StopThread:
 			pass
\ No newline at end of file
@@ -0,0 +1,82 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import indigo
+
+################################################################################
+class RegisteredDevice(object):
+	#What the plugin knows about one of its Indigo devices
+	__slots__ = ('key', 'devID', 'dev', 'published', 'publishedAt', 'imageOn', 'deadband')
+
+	def __init__(self, key, devID, dev=None):
+		self.key = key
+		self.devID = devID
+		self.dev = dev #Cached Indigo device, fetched on first use
+		self.published = None #Power last sent to Indigo, None for "Off" devices
+		self.publishedAt = None #Time power was last sent to Indigo, None if it never was
+		self.imageOn = None #State image last sent to Indigo, True for PowerOn
+		self.deadband = None #Device's own deadband settings, if any
+
+################################################################################
+class DeviceRegistry(object):
+	#The plugin's Indigo devices, indexed by key (Sense ID, prefixed with the monitor for secondary monitors) and by Indigo ID
+	def __init__(self):
+		self.byKey = dict()
+		self.byDev = dict()
+		self.version = 0 #Changes whenever a device is added or removed
+
+	def __len__(self):
+		return len(self.byKey)
+
+	def __contains__(self, key):
+		return key in self.byKey
+
+	def __iter__(self):
+		return iter(list(self.byKey.values()))
+
+	def add(self, key, devID, dev=None):
+		devID = int(devID)
+		#An Indigo device can only have one key, and a key one Indigo device
+		self.removeDev(devID)
+		self.removeKey(key)
+		entry = RegisteredDevice(key, devID, dev)
+		self.byKey[key] = entry
+		self.byDev[devID] = entry
+		self.version += 1
+		return entry
+
+	def get(self, key):
+		return self.byKey.get(key)
+
+	def getDev(self, devID):
+		return self.byDev.get(int(devID))
+
+	def devID(self, key):
+		return self.byKey[key].devID
+
+	def device(self, key):
+		#Indigo device for a key, only asking the Indigo server the first time
+		entry = self.byKey[key]
+		if (entry.dev is None):
+			entry.dev = indigo.devices[entry.devID]
+		return entry.dev
+
+	def refresh(self, dev):
+		#Replace the cached copy of an Indigo device that was changed
+		entry = self.byDev.get(int(dev.id))
+		if (entry is not None):
+			entry.dev = dev
+
+	def removeKey(self, key):
+		entry = self.byKey.pop(key, None)
+		if (entry is not None):
+			self.byDev.pop(entry.devID, None)
+			self.version += 1
+		return entry
+
+	def removeDev(self, devID):
+		entry = self.byDev.pop(int(devID), None)
+		if (entry is not None):
+			self.byKey.pop(entry.key, None)
+			self.version += 1
+		return entry
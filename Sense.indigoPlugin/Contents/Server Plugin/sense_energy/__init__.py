@@ -1,9 +1,17 @@
-from .sense_api import SenseableBase
+from .sense_api import SenseableBase, set_json_decoder
 from .sense_exceptions import *
 
+from .catalog import DeviceCatalog
+from .deadband import Deadband
+from .history import HistoryStore, RateBudget
+from .realtime import RealtimeDelta, RealtimeSnapshot, diff_device_power
+from .records import Device, RealtimeSample, TrendSnapshot
+from .scheduler import PollScheduler
 from .senseable import Senseable
+from .token_cache import TokenCache
 import sys
 if sys.version_info >= (3, 5):
+    from .asynchub import RealtimeHub, RealtimeSubscription
     from .asyncsenseable import ASyncSenseable
 
 __version__ = "0.7.0"
@@ -0,0 +1,103 @@
+import threading
+from collections import namedtuple
+from time import time
+
+# realtime keys aggregated alongside the devices
+TOTAL_KEYS = ('w', 'solar_w')
+
+PowerSummary = namedtuple('PowerSummary', ['mean', 'min', 'max', 'last'])
+
+WindowSummary = namedtuple('WindowSummary',
+                           ['start', 'end', 'frames', 'totals', 'devices'])
+
+
+class _RunningStats(object):
+    """ Running sum/min/max/last of one power value. Frames in which the
+        value was missing count as 0 W, without storing the samples"""
+    __slots__ = ('sum', 'min', 'max', 'last', 'seen', 'last_frame')
+
+    def __init__(self):
+        self.sum = 0.0
+        self.min = None
+        self.max = None
+        self.last = 0
+        self.seen = 0
+        self.last_frame = 0
+
+    def add(self, value, frame):
+        self.sum += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+        self.last = value
+        self.seen += 1
+        self.last_frame = frame
+
+    def summary(self, frames):
+        low, high = self.min, self.max
+        if self.seen < frames:
+            # off for part of the window
+            low, high = min(low, 0), max(high, 0)
+        last = self.last if self.last_frame == frames else 0
+        return PowerSummary(self.sum / frames, low, high, last)
+
+
+class RealtimeAggregator(object):
+    """ Aggregates every realtime update into per-device and total
+        mean/min/max/last until pop() is called. If nobody pops for
+        longer than window seconds, the stale window is dropped"""
+
+    def __init__(self, window=None):
+        self.window = window
+        self._lock = threading.Lock()
+        self._reset(None)
+
+    def _reset(self, start):
+        self._start = start
+        self._end = start
+        self._frames = 0
+        self._totals = {}
+        self._devices = {}
+
+    def add(self, data, received=None):
+        if received is None:
+            received = time()
+        with self._lock:
+            if self._start is None or (
+                    self.window and received - self._start >= self.window):
+                self._reset(received)
+            self._frames += 1
+            self._end = received
+            frame = self._frames
+            for key in TOTAL_KEYS:
+                if key in data:
+                    stats = self._totals.get(key)
+                    if stats is None:
+                        stats = self._totals[key] = _RunningStats()
+                    stats.add(data[key], frame)
+            for d in data.get('devices', []):
+                stats = self._devices.get(d['id'])
+                if stats is None:
+                    stats = self._devices[d['id']] = _RunningStats()
+                stats.add(d['w'], frame)
+
+    def peek(self):
+        with self._lock:
+            return self._summary()
+
+    def pop(self):
+        """ Returns the current window and starts a new one"""
+        with self._lock:
+            summary = self._summary()
+            self._reset(None)
+            return summary
+
+    def _summary(self):
+        frames = self._frames
+        if not frames:
+            return WindowSummary(self._start, self._end, 0, {}, {})
+        return WindowSummary(
+            self._start, self._end, frames,
+            dict((k, s.summary(frames)) for k, s in self._totals.items()),
+            dict((k, s.summary(frames)) for k, s in self._devices.items()))
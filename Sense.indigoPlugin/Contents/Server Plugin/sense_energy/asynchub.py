@@ -0,0 +1,138 @@
+import asyncio
+from time import time
+
+from .realtime import STABLE_AFTER, Backoff, is_auth_error
+
+# realtime updates buffered per subscriber before the oldest is dropped
+SUBSCRIBER_QUEUE_SIZE = 10
+
+_CLOSED = object()
+
+
+class RealtimeSubscription(object):
+    """ One consumer's view of a RealtimeHub, an async iterator over the
+        realtime updates. A consumer that falls behind loses its oldest
+        updates, never the latest:
+
+            async for data in hub.subscribe():
+                ...
+    """
+
+    def __init__(self, hub, maxsize=SUBSCRIBER_QUEUE_SIZE):
+        self._hub = hub
+        self._queue = asyncio.Queue(maxsize)
+        self.dropped = 0
+        self.closed = False
+
+    def put(self, item):
+        while True:
+            try:
+                self._queue.put_nowait(item)
+                return
+            except asyncio.QueueFull:
+                try:
+                    self._queue.get_nowait()
+                    self.dropped += 1
+                except asyncio.QueueEmpty:
+                    pass
+
+    def close(self):
+        """ Stops the iteration once the queued updates are read"""
+        if not self.closed:
+            self.closed = True
+            self._hub.unsubscribe(self)
+            self.put(_CLOSED)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        item = await self._queue.get()
+        if item is _CLOSED:
+            raise StopAsyncIteration
+        return item
+
+
+class RealtimeHub(object):
+    """ Feeds every subscriber from a single realtime websocket of an
+        ASyncSenseable monitor, reconnecting with backoff while anyone
+        listens"""
+
+    def __init__(self, sense, queue_size=SUBSCRIBER_QUEUE_SIZE, backoff=None,
+                 monitor_id=None):
+        self.sense = sense
+        self.monitor_id = monitor_id
+        self.queue_size = queue_size
+        self.backoff = backoff or Backoff()
+        self.last_error = None
+        self._subscribers = []
+        self._task = None
+        self._connected_at = None
+
+    @property
+    def running(self):
+        return self._task is not None and not self._task.done()
+
+    @property
+    def subscribers(self):
+        return len(self._subscribers)
+
+    def subscribe(self, maxsize=None):
+        """ Returns a new RealtimeSubscription, opening the upstream
+            connection if needed. Call from inside the event loop"""
+        subscription = RealtimeSubscription(self, maxsize or self.queue_size)
+        self._subscribers.append(subscription)
+        if not self.running:
+            self._task = asyncio.ensure_future(self._run())
+        return subscription
+
+    def unsubscribe(self, subscription):
+        if subscription in self._subscribers:
+            self._subscribers.remove(subscription)
+        # nobody left listening, close the upstream connection. The task
+        # only finishes on its next await, forget it now so a subscriber
+        # arriving before then starts a new one
+        if not self._subscribers and self.running:
+            self._task.cancel()
+            self._task = None
+
+    async def stop(self):
+        # closing the last subscription forgets the task, keep it to wait
+        # until the upstream connection is really closed
+        task = self._task
+        self._task = None
+        for subscription in list(self._subscribers):
+            subscription.close()
+        if task is not None:
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+
+    def _publish(self, data):
+        if self._connected_at is None:
+            self._connected_at = time()
+        for subscription in self._subscribers:
+            subscription.put(data)
+
+    async def _run(self):
+        while True:
+            self._connected_at = None
+            try:
+                await self.sense.async_realtime_stream(
+                    callback=self._publish, monitor_id=self.monitor_id)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.last_error = e
+                if is_auth_error(e):
+                    try:
+                        await self.sense.reauthenticate()
+                    except Exception as e:
+                        self.last_error = e
+            # only a connection that stayed up resets the backoff
+            if self._connected_at is not None and \
+               time() - self._connected_at >= STABLE_AFTER:
+                self.backoff.reset()
+            await asyncio.sleep(self.backoff.next())
@@ -3,33 +3,100 @@ import aiohttp
 import json
 import websockets
 
+from .asynchub import RealtimeHub
+from .records import Device
 from .sense_api import *
 from .sense_exceptions import *
 
+# connections kept open to the API, enough for a full trend refresh
+CONNECTION_LIMIT = 8
+# seconds resolved API addresses and idle keep-alive connections are kept
+DNS_CACHE_TTL = 300
+KEEPALIVE_TIMEOUT = 60
+
 class ASyncSenseable(SenseableBase):
-    
+    """ asyncio client sharing one aiohttp session, and its pool of
+        keep-alive connections, across every call. Use it as an async
+        context manager or call close() when done:
+
+            async with ASyncSenseable(username, password) as sense:
+                await sense.update_trend_data()
+    """
+
+    def __init__(self, username=None, password=None,
+                 api_timeout=API_TIMEOUT, wss_timeout=WSS_TIMEOUT,
+                 connection_limit=CONNECTION_LIMIT,
+                 dns_cache_ttl=DNS_CACHE_TTL,
+                 keepalive_timeout=KEEPALIVE_TIMEOUT):
+        # authenticating needs a running loop, so it happens on __aenter__
+        self._credentials = (username, password) if username else None
+        self.connection_limit = connection_limit
+        self.dns_cache_ttl = dns_cache_ttl
+        self.keepalive_timeout = keepalive_timeout
+        self.rate_limit = RATE_LIMIT
+        self._session = None
+        # one RealtimeHub per monitor
+        self._hubs = {}
+        super(ASyncSenseable, self).__init__(
+            api_timeout=api_timeout, wss_timeout=wss_timeout)
+
+    async def __aenter__(self):
+        if self._credentials and not hasattr(self, 'sense_access_token'):
+            await self.authenticate(*self._credentials)
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    def _get_session(self):
+        # created lazily, aiohttp wants it made inside the running loop
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.connection_limit,
+                ttl_dns_cache=self.dns_cache_ttl,
+                keepalive_timeout=self.keepalive_timeout)
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=aiohttp.ClientTimeout(total=self.api_timeout))
+        return self._session
+
+    async def close(self):
+        for hub in list(self._hubs.values()):
+            await hub.stop()
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
     async def authenticate(self, username, password):
+        self._credentials = (username, password)
         auth_data = {
             "email": username,
             "password": password
         }
 
         # Get auth token
+        self.api_calls += 1
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.post(API_URL+'authenticate',
-                                        data=auth_data) as resp:
-
-                    # check for 200 return
-                    if resp.status != 200:
-                        raise SenseAuthenticationException(
-                            "Please check username and password. API Return Code: %s" %
-                            resp.status)
-
-                    # Build out some common variables
-                    self.set_auth_data(await resp.json())
+            async with self._get_session().post(API_URL+'authenticate',
+                                                data=auth_data) as resp:
+
+                # check for 200 return
+                if resp.status != 200:
+                    raise SenseAuthenticationException(
+                        "Please check username and password. API Return Code: %s" %
+                        resp.status)
+
+                # Build out some common variables
+                self.set_auth_data(await resp.json())
+        except SenseAuthenticationException:
+            raise
         except Exception as e:
-            raise Exception('Connection failure: %s' % e)
+            raise SenseAPIException('Connection failure: %s' % e)
+
+    async def reauthenticate(self):
+        """ Fetches a new access token with the last credentials, used when
+            Sense refuses the current one"""
+        await self.authenticate(*self._credentials)
                 
     # Update the realtime data for asyncio
     async def update_realtime(self):
@@ -40,9 +107,11 @@ class ASyncSenseable(SenseableBase):
         self.last_realtime_call = time()
         await self.async_realtime_stream(single=True)
     
-    async def async_realtime_stream(self, callback=None, single=False):
+    async def async_realtime_stream(self, callback=None, single=False,
+                                    monitor_id=None):
         """ Reads realtime data from websocket"""
-        url = WS_URL % (self.sense_monitor_id, self.sense_access_token)
+        monitor_id = monitor_id or self.sense_monitor_id
+        url = WS_URL % (monitor_id, self.sense_access_token)
         # hello, features, [updates,] data
         async with websockets.connect(url) as ws:
             while True:
@@ -52,53 +121,108 @@ class ASyncSenseable(SenseableBase):
                 except asyncio.TimeoutError:
                     raise SenseAPITimeoutException("API websocket timed out")
                 
-                result = json.loads(message)
+                # skip hello, features etc. without a full parse
+                if message_type(message) not in STREAM_TYPES:
+                    continue
+                result = decode_json(message)
                 if result.get('type') == 'realtime_update':
                     data = result['payload']
-                    self.set_realtime(data)
+                    self.set_realtime(data, monitor_id)
                     if callback: callback(data)
                     if single: return
                 elif result.get('type') == 'error':
                     data = result['payload']
                     raise SenseWebsocketException(data['error_reason'])
             
+    def get_realtime_hub(self, monitor_id=None):
+        """ RealtimeHub sharing one realtime websocket of a monitor, the
+            primary one by default, between any number of subscribers"""
+        monitor_id = monitor_id or self.sense_monitor_id
+        hub = self._hubs.get(monitor_id)
+        if hub is None:
+            hub = RealtimeHub(self, monitor_id=monitor_id)
+            self._hubs[monitor_id] = hub
+        return hub
+
     async def get_realtime_future(self, callback):
         """ Returns an async Future to parse realtime data with callback"""
         await self.async_realtime_stream(callback)
         
     async def api_call(self, url, payload={}):
-        timeout = aiohttp.ClientTimeout(total=self.api_timeout)
-        async with aiohttp.ClientSession() as session:
-            async with session.get(API_URL + url,
-                          headers=self.headers,
-                          timeout=timeout,
-                          data=payload) as resp:
-                return await resp.json()
-        # timed out
-        raise SenseAPITimeoutException("API call timed out") 
+        try:
+            status, data = await self._get(url, payload)
+            if status == 401 and self._credentials:
+                # token expired or revoked, log in again and retry once
+                await self.reauthenticate()
+                status, data = await self._get(url, payload)
+            if status == 401:
+                raise SenseAuthenticationException("API call refused")
+            return data
+        except asyncio.TimeoutError:
+            raise SenseAPITimeoutException("API call timed out") 
+        except aiohttp.ClientError as e:
+            raise SenseAPIException("API call failed: %s" % e)
+
+    async def _get(self, url, payload):
+        self.api_calls += 1
+        async with self._get_session().get(API_URL + url,
+                                           headers=self.headers,
+                                           data=payload) as resp:
+            if resp.status == 401:
+                return resp.status, None
+            if resp.status >= 400:
+                raise SenseAPIException("API call failed: %s %s" %
+                                        (resp.status, resp.reason))
+            try:
+                return resp.status, await resp.json()
+            except ValueError as e:
+                raise SenseAPIException(
+                    "API call returned invalid JSON: %s" % e)
 
     async def get_trend_data(self, scale):
         if scale.upper() not in valid_scales:
             raise Exception("%s not a valid scale" % scale)
-        t = datetime.now().replace(hour=12)
-        json = self.api_call(
+        # noon today, the same URL all day
+        t = datetime.now().replace(hour=12, minute=0, second=0, microsecond=0)
+        data = await self.api_call(
             'app/history/trends?monitor_id=%s&scale=%s&start=%s' %
             (self.sense_monitor_id, scale, t.isoformat()))
-        self._trend_data[scale] = await json
+        self.set_trend_data(scale, data)
+
+    async def _timed_trend_data(self, scale, timeout):
+        try:
+            await asyncio.wait_for(self.get_trend_data(scale), timeout)
+        except asyncio.TimeoutError:
+            raise SenseAPITimeoutException("%s trend data timed out" % scale)
 
-    async def update_trend_data(self):
-        for scale in valid_scales:
-            await self.get_trend_data(scale)
+    async def update_trend_data(self, force=False, timeout=None):
+        """ Fetches every scale older than its trend_ttl, or all of
+            them with force, concurrently. Each request gets timeout
+            seconds (api_timeout by default). A failed scale keeps its old
+            data and doesn't stop the others, the first failure is raised
+            once they have all finished"""
+        scales = valid_scales if force else self.stale_trend_scales()
+        timeout = timeout or self.api_timeout
+        results = await asyncio.gather(
+            *[self._timed_trend_data(scale, timeout) for scale in scales],
+            return_exceptions=True)
+        errors = [r for r in results if isinstance(r, Exception)]
+        if errors:
+            self.trend_error = errors[0]
+            raise self.trend_error
 
     async def get_discovered_device_names(self):
         # lots more info in here to be parsed out
-        json = self.api_call('app/monitors/%s/devices' %
-                                 self.sense_monitor_id)
-        self._devices = await [entry['name'] for entry in json]
+        json = await self.api_call('app/monitors/%s/devices' %
+                                   self.sense_monitor_id)
+        self._devices = [entry['name'] for entry in json]
         return self._devices
 
-    async def get_discovered_device_data(self):
-        json = self.api_call('monitors/%s/devices' %
-                             self.sense_monitor_id)
-        return await json
+    async def get_discovered_device_data(self, monitor_id=None):
+        return await self.api_call('monitors/%s/devices' %
+                                   (monitor_id or self.sense_monitor_id))
 
+    async def get_devices(self, monitor_id=None):
+        """ Discovered devices as Device records"""
+        return [Device.from_json(d)
+                for d in await self.get_discovered_device_data(monitor_id)]
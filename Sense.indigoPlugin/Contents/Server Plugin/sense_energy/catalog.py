@@ -0,0 +1,86 @@
+import threading
+from time import time
+
+from .sense_exceptions import *
+
+# seconds between scheduled refreshes of the device list
+CATALOG_REFRESH = 60 * 60
+# unknown realtime devices or failures can't refresh it more often than this
+CATALOG_MIN_REFRESH = 60
+
+
+class DeviceCatalog(object):
+    """ The discovered Device list, fetched on a long interval instead of
+        every poll. It is refreshed early when the realtime stream reports
+        a device it doesn't know, and listeners are called whenever the
+        list actually changes"""
+
+    def __init__(self, fetch, refresh_interval=CATALOG_REFRESH,
+                 min_interval=CATALOG_MIN_REFRESH):
+        self._fetch = fetch
+        self.refresh_interval = refresh_interval
+        self.min_interval = min_interval
+        self.devices = []
+        self.version = 0
+        self.fetched = 0
+        self.last_error = None
+        self._ids = frozenset()
+        # realtime ids still unknown after the last refresh
+        self._unresolved = frozenset()
+        self._retry_at = 0
+        self._listeners = []
+        self._lock = threading.Lock()
+
+    def __contains__(self, device_id):
+        return device_id in self._ids
+
+    def add_listener(self, callback):
+        """ callback(catalog) is called after the device list changed"""
+        self._listeners.append(callback)
+
+    def remove_listener(self, callback):
+        self._listeners.remove(callback)
+
+    def invalidate(self):
+        """ Refresh on the next update()"""
+        self.fetched = 0
+        self._retry_at = 0
+
+    def needs_refresh(self, device_ids=()):
+        now = time()
+        if now < self._retry_at:
+            return False
+        if now - self.fetched >= self.refresh_interval:
+            return True
+        if now - self.fetched < self.min_interval:
+            return False
+        unknown = set(device_ids) - self._ids
+        return bool(unknown - self._unresolved)
+
+    def update(self, device_ids=()):
+        """ Returns the device list, refreshing it first if it is due or
+            device_ids (e.g. the ids in a realtime update) has new ones.
+            If the refresh fails the previous list is kept"""
+        if self.needs_refresh(device_ids):
+            try:
+                self.refresh(device_ids)
+            except SenseAPIException as e:
+                self.last_error = e
+                self._retry_at = time() + self.min_interval
+        return self.devices
+
+    def refresh(self, device_ids=()):
+        with self._lock:
+            devices = self._fetch()
+            self.fetched = time()
+            self._retry_at = 0
+            changed = devices != self.devices
+            if changed:
+                self.devices = devices
+                self._ids = frozenset(d.id for d in devices)
+                self.version += 1
+            self._unresolved = frozenset(set(device_ids) - self._ids)
+        if changed:
+            for callback in list(self._listeners):
+                callback(self)
+        return changed
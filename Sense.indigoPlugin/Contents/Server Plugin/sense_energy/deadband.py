@@ -0,0 +1,47 @@
+# seconds after which a device is written again even if it didn't change
+HEARTBEAT = 10 * 60
+
+
+class Deadband(object):
+    """ Decides whether a device's power is worth writing again. A change
+        has to be more than watts, and more than percent of the last
+        written power, and come at least min_interval seconds after the
+        last write. Turning on or off always passes, and everything is
+        written again after heartbeat seconds (0 never)"""
+    __slots__ = ('watts', 'percent', 'min_interval', 'heartbeat')
+
+    def __init__(self, watts=0, percent=0, min_interval=0,
+                 heartbeat=HEARTBEAT):
+        self.watts = watts
+        self.percent = percent
+        self.min_interval = min_interval
+        self.heartbeat = heartbeat
+
+    def override(self, watts=None, percent=None, min_interval=None,
+                 heartbeat=None):
+        """ Copy with the given settings replaced, None keeps this one's"""
+        def pick(value, default):
+            return default if value is None else value
+        return Deadband(pick(watts, self.watts),
+                        pick(percent, self.percent),
+                        pick(min_interval, self.min_interval),
+                        pick(heartbeat, self.heartbeat))
+
+    def allows(self, old, new, elapsed):
+        """ old and new are the power in watts, None while the device is
+            off, elapsed the seconds since old was written (None if it
+            never was)"""
+        if elapsed is None:
+            return True
+        if self.heartbeat and elapsed >= self.heartbeat:
+            return True
+        if (old is None) != (new is None):
+            return True
+        if old is None or elapsed < self.min_interval:
+            return False
+        change = abs(new - old)
+        return change > self.watts and change * 100 > self.percent * abs(old)
+
+    def __repr__(self):
+        return 'Deadband(%r, %r, %r, %r)' % (self.watts, self.percent,
+                                             self.min_interval, self.heartbeat)
@@ -0,0 +1,158 @@
+import json
+import sqlite3
+import threading
+from datetime import timedelta
+from time import sleep, time
+
+# minimum seconds between backfill requests, keeps well inside Sense's limits
+BACKFILL_INTERVAL = 2.0
+
+# scales history can be walked in, one request per period
+HISTORY_SCALES = ['DAY', 'WEEK', 'MONTH', 'YEAR']
+
+
+class RateBudget(object):
+    """ Spaces API calls at least interval seconds apart"""
+
+    def __init__(self, interval=BACKFILL_INTERVAL):
+        self.interval = interval
+        self.calls = 0
+        self._next = 0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        with self._lock:
+            now = time()
+            if now < self._next:
+                sleep(self._next - now)
+                now = self._next
+            self._next = now + self.interval
+            self.calls += 1
+
+
+def period_start(scale, day):
+    """ First day of the scale period holding day"""
+    if scale not in HISTORY_SCALES:
+        raise Exception("%s not a valid history scale" % scale)
+    if scale == 'WEEK':
+        return day - timedelta(days=day.weekday())
+    if scale == 'MONTH':
+        return day.replace(day=1)
+    if scale == 'YEAR':
+        return day.replace(month=1, day=1)
+    return day
+
+
+def next_period(scale, day):
+    """ First day of the scale period after the one starting on day"""
+    if scale == 'WEEK':
+        return day + timedelta(days=7)
+    if scale == 'MONTH':
+        return (day.replace(day=28) + timedelta(days=4)).replace(day=1)
+    if scale == 'YEAR':
+        return day.replace(year=day.year + 1)
+    return day + timedelta(days=1)
+
+
+def period_starts(scale, start, end):
+    """ First day of every scale period from the one holding start up to
+        the one holding end"""
+    day = period_start(scale, start)
+    while day <= end:
+        yield day
+        day = next_period(scale, day)
+
+
+def trend_record(monitor_id, scale, start, data):
+    def total(key):
+        return (data.get(key) or {}).get('total', 0)
+    return {
+        'monitor_id': monitor_id,
+        'scale': scale,
+        'start': start.isoformat(),
+        'consumption': total('consumption'),
+        'production': total('production'),
+        'data': data
+    }
+
+
+class HistoryStore(object):
+    """ Local SQLite store for backfilled trend and timeline records, with
+        checkpoints so an interrupted backfill resumes where it stopped"""
+
+    def __init__(self, path):
+        self.path = path
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._db:
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS trends ("
+                "monitor_id TEXT, scale TEXT, start TEXT, "
+                "consumption REAL, production REAL, data TEXT, "
+                "PRIMARY KEY (monitor_id, scale, start))")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS timeline ("
+                "user_id TEXT, time TEXT, type TEXT, data TEXT, "
+                "PRIMARY KEY (user_id, time, type))")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS checkpoints ("
+                "name TEXT PRIMARY KEY, value TEXT)")
+
+    def close(self):
+        self._db.close()
+
+    def get_checkpoint(self, name):
+        with self._lock:
+            row = self._db.execute(
+                "SELECT value FROM checkpoints WHERE name = ?",
+                (name,)).fetchone()
+        return row[0] if row else None
+
+    def set_checkpoint(self, name, value):
+        with self._lock, self._db:
+            self._checkpoint(name, value)
+
+    def _checkpoint(self, name, value):
+        self._db.execute(
+            "INSERT OR REPLACE INTO checkpoints (name, value) VALUES (?, ?)",
+            (name, value))
+
+    def add_trend(self, record, checkpoint=None):
+        """ Stores one trend record, and moves the checkpoint to it in the
+            same transaction"""
+        with self._lock, self._db:
+            self._db.execute(
+                "INSERT OR REPLACE INTO trends VALUES (?, ?, ?, ?, ?, ?)",
+                (str(record['monitor_id']), record['scale'], record['start'],
+                 record['consumption'], record['production'],
+                 json.dumps(record['data'])))
+            if checkpoint:
+                self._checkpoint(checkpoint, record['start'])
+
+    def add_timeline_item(self, user_id, item, checkpoint=None):
+        with self._lock, self._db:
+            self._db.execute(
+                "INSERT OR REPLACE INTO timeline VALUES (?, ?, ?, ?)",
+                (str(user_id), item.get('time'), item.get('type'),
+                 json.dumps(item)))
+            if checkpoint:
+                self._checkpoint(checkpoint, item.get('time'))
+
+    def trends(self, monitor_id, scale, start=None, end=None):
+        """ Yields stored (start, consumption, production) rows in order"""
+        query = ("SELECT start, consumption, production FROM trends "
+                 "WHERE monitor_id = ? AND scale = ?")
+        args = [str(monitor_id), scale]
+        if start:
+            query += " AND start >= ?"
+            args.append(start.isoformat())
+        if end:
+            query += " AND start <= ?"
+            args.append(end.isoformat())
+        with self._lock:
+            rows = self._db.execute(query + " ORDER BY start", args)
+            row = rows.fetchone()
+        while row:
+            yield row
+            with self._lock:
+                row = rows.fetchone()
@@ -0,0 +1,178 @@
+import random
+import threading
+from collections import namedtuple
+from time import time
+
+from .records import RealtimeSample
+from .sense_exceptions import *
+
+# reconnect delay bounds in seconds
+BACKOFF_MIN = 1
+BACKOFF_MAX = 120
+# seconds a connection must stay up before the backoff starts over
+STABLE_AFTER = 60
+
+# RealtimeReader.state
+STOPPED = 'stopped'
+CONNECTING = 'connecting'
+CONNECTED = 'connected'
+BACKOFF = 'backoff'
+
+
+class RealtimeSnapshot(namedtuple('RealtimeSnapshot',
+                                  ['seq', 'received', 'data', 'sample'])):
+    """ Immutable view of one realtime update, the raw data and its
+        parsed RealtimeSample. A new snapshot replaces the previous one in
+        a single reference swap, so readers on other threads never need
+        a lock"""
+    __slots__ = ()
+
+    @property
+    def age(self):
+        return time() - self.received
+
+    def device_power(self):
+        """ {id: w} of every device that is on, shared with the snapshot
+            so don't modify it"""
+        return self.sample.devices
+
+
+EMPTY_SNAPSHOT = RealtimeSnapshot(0, 0, {}, RealtimeSample())
+
+
+class RealtimeDelta(namedtuple('RealtimeDelta',
+                               ['turned_on', 'turned_off', 'changed'])):
+    """ Devices that turned on ({id: w}), turned off (set of ids) or
+        changed power ({id: w}) between two realtime readings"""
+    __slots__ = ()
+
+    def __len__(self):
+        return len(self.turned_on) + len(self.turned_off) + len(self.changed)
+
+    def updates(self):
+        """ Every change as {id: w}, 0 for devices that turned off"""
+        power = dict.fromkeys(self.turned_off, 0)
+        power.update(self.turned_on)
+        power.update(self.changed)
+        return power
+
+    def apply(self, power):
+        """ Brings a {id: w} dict from the old reading to the new one"""
+        for sID in self.turned_off:
+            power.pop(sID, None)
+        power.update(self.turned_on)
+        power.update(self.changed)
+        return power
+
+
+def diff_device_power(previous, current, threshold=0):
+    """ Compares two {id: w} readings, such as from
+        RealtimeSnapshot.device_power(). Devices missing from a reading
+        are off, power changes of threshold watts or less are ignored"""
+    turned_on = {}
+    changed = {}
+    for sID, w in current.items():
+        old = previous.get(sID)
+        if old is None:
+            turned_on[sID] = w
+        elif abs(w - old) > threshold:
+            changed[sID] = w
+    turned_off = set(sID for sID in previous if sID not in current)
+    return RealtimeDelta(turned_on, turned_off, changed)
+
+
+class Backoff(object):
+    """ Exponential reconnect delay with jitter, so a flapping link
+        doesn't turn into a reconnect storm"""
+
+    def __init__(self, minimum=BACKOFF_MIN, maximum=BACKOFF_MAX, factor=2):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.factor = factor
+        self.reset()
+
+    def reset(self):
+        self.attempts = 0
+
+    def next(self):
+        delay = min(self.maximum,
+                    self.minimum * self.factor ** self.attempts)
+        self.attempts += 1
+        # keep at least half the delay, randomise the rest
+        return delay / 2.0 + random.uniform(0, delay / 2.0)
+
+
+def is_auth_error(e):
+    """ True if the websocket was refused because of the access token"""
+    if isinstance(e, SenseAuthenticationException):
+        return True
+    if getattr(e, 'status_code', None) in (401, 403):
+        return True
+    if isinstance(e, SenseWebsocketException):
+        reason = str(e).lower()
+        return 'token' in reason or 'auth' in reason
+    return False
+
+
+class RealtimeReader(threading.Thread):
+    """ Keeps one monitor's realtime websocket open for the life of a
+        Senseable and feeds every update into it, reconnecting with backoff and
+        re-authenticating when the token is refused"""
+
+    def __init__(self, sense, monitor_id=None, backoff=None,
+                 stable_after=STABLE_AFTER):
+        threading.Thread.__init__(
+            self, name="SenseRealtimeReader-%s" % (monitor_id or 'primary'))
+        self.daemon = True
+        self.sense = sense
+        self.monitor_id = monitor_id
+        self.backoff = backoff or Backoff()
+        self.stable_after = stable_after
+        self.state = STOPPED
+        self.last_error = None
+        self.reconnects = 0
+        self._stop_event = threading.Event()
+
+    @property
+    def running(self):
+        return self.is_alive() and not self._stop_event.is_set()
+
+    def stop(self, timeout=None):
+        self._stop_event.set()
+        if self.is_alive() and threading.current_thread() is not self:
+            self.join(timeout)
+
+    def run(self):
+        while not self._stop_event.is_set():
+            self.state = CONNECTING
+            connected_at = None
+            stream = self.sense.get_realtime_stream(self.monitor_id)
+            try:
+                # get_realtime_stream stores every update via set_realtime,
+                # we only need to keep pulling from it
+                for _ in stream:
+                    if connected_at is None:
+                        connected_at = time()
+                        self.state = CONNECTED
+                    if self._stop_event.is_set():
+                        break
+            except Exception as e:
+                self.last_error = e
+                if is_auth_error(e):
+                    try:
+                        self.sense.reauthenticate()
+                    except Exception as e:
+                        self.last_error = e
+            finally:
+                # closes the websocket
+                stream.close()
+            if self._stop_event.is_set():
+                break
+            # only a connection that stayed up resets the backoff
+            if connected_at is not None and \
+               time() - connected_at >= self.stable_after:
+                self.backoff.reset()
+            self.state = BACKOFF
+            self.reconnects += 1
+            self._stop_event.wait(self.backoff.next())
+        self.state = STOPPED
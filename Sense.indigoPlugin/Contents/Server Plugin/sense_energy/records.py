@@ -0,0 +1,77 @@
+def _flag(tags, name):
+    return tags.get(name) == 'true'
+
+
+class Device(object):
+    """ One discovered device, with its tags decoded once when the device
+        list is fetched"""
+    __slots__ = ('id', 'name', 'icon', 'revoked', 'merged_ids', 'tags')
+
+    def __init__(self, id, name, icon=None, revoked=False, merged_ids=(),
+                 tags=None):
+        self.id = id
+        self.name = name
+        self.icon = icon
+        self.revoked = revoked
+        self.merged_ids = merged_ids
+        self.tags = tags or {}
+
+    @classmethod
+    def from_json(cls, data):
+        tags = data.get('tags') or {}
+        merged = tags.get('MergedDevices')
+        return cls(data['id'], data.get('name'), data.get('icon'),
+                   _flag(tags, 'Revoked') or _flag(tags, 'UserDeleted'),
+                   tuple(merged.split(',')) if merged else (),
+                   tags)
+
+    def _key(self):
+        return (self.id, self.name, self.icon, self.revoked, self.merged_ids,
+                self.tags)
+
+    def __eq__(self, other):
+        return isinstance(other, Device) and self._key() == other._key()
+
+    def __ne__(self, other):
+        return not self == other
+
+    __hash__ = None
+
+    def __repr__(self):
+        return 'Device(%r, %r)' % (self.id, self.name)
+
+
+class RealtimeSample(object):
+    """ The values of one realtime update. devices maps the id of every
+        device that is on to its power in whole watts"""
+    __slots__ = ('w', 'solar_w', 'voltage', 'hz', 'devices')
+
+    def __init__(self, w=0, solar_w=0, voltage=0, hz=0, devices=None):
+        self.w = w
+        self.solar_w = solar_w
+        self.voltage = voltage
+        self.hz = hz
+        self.devices = devices or {}
+
+    @classmethod
+    def from_json(cls, data):
+        return cls(data.get('w', 0), data.get('solar_w', 0),
+                   data.get('voltage', 0), data.get('hz', 0),
+                   dict((d['id'], int(d['w']))
+                        for d in data.get('devices', [])))
+
+
+class TrendSnapshot(object):
+    """ Consumption and production totals of one trend scale. WEEK and
+        MONTH include today and YEAR includes this month, rolled up once
+        when trend data is stored rather than on every read"""
+    __slots__ = ('scale', 'consumption', 'production', 'fetched')
+
+    def __init__(self, scale, consumption=0, production=0, fetched=0):
+        self.scale = scale
+        self.consumption = consumption
+        self.production = production
+        self.fetched = fetched
+
+    def total(self, is_production):
+        return self.production if is_production else self.consumption
@@ -0,0 +1,68 @@
+import threading
+from collections import OrderedDict, namedtuple
+
+# bytes of response bodies kept before the least recently used are dropped
+RESPONSE_CACHE_BYTES = 2 * 1024 * 1024
+
+CachedResponse = namedtuple('CachedResponse',
+                            ['etag', 'last_modified', 'data', 'size'])
+
+
+class ResponseCache(object):
+    """ Parsed API responses with their ETag/Last-Modified validators, so
+        an unchanged resource can be answered by a 304 and reused without
+        downloading or decoding it again. Bounded by the size of the
+        original bodies, evicting the least recently used"""
+
+    def __init__(self, max_bytes=RESPONSE_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                # most recently used last
+                self._entries[key] = entry
+            return entry
+
+    def put(self, key, etag, last_modified, data, size):
+        if not (etag or last_modified) or size > self.max_bytes:
+            self.discard(key)
+            return
+        with self._lock:
+            self._pop(key)
+            self._entries[key] = CachedResponse(etag, last_modified, data, size)
+            self.size += size
+            while self.size > self.max_bytes:
+                self._pop(next(iter(self._entries)))
+
+    def discard(self, key):
+        with self._lock:
+            self._pop(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+    def _pop(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.size -= entry.size
+
+    @staticmethod
+    def validators(entry):
+        """ Conditional request headers for a cached entry"""
+        headers = {}
+        if entry.etag:
+            headers['If-None-Match'] = entry.etag
+        if entry.last_modified:
+            headers['If-Modified-Since'] = entry.last_modified
+        return headers
@@ -0,0 +1,83 @@
+from collections import deque
+from time import time
+
+# seconds between polls are kept within these
+POLL_FLOOR = 5
+POLL_CEILING = 120
+# a total power change of this many watts between polls counts as activity
+ACTIVE_WATTS = 50
+# seconds the API call budget is counted over
+BUDGET_PERIOD = 60 * 60
+
+
+class PollScheduler(object):
+    """ Picks the seconds until the next poll from how busy the house is.
+        The interval halves after a poll that saw a device turn on or off,
+        or the total or a device's power move by active_watts or more, and
+        grows by half after a quiet one, staying between floor and
+        ceiling.
+
+        With a budget of API calls per hour, the interval stops shrinking
+        while more calls than that were made over the last hour, and is
+        stretched in proportion when they go over"""
+
+    def __init__(self, floor=POLL_FLOOR, ceiling=POLL_CEILING,
+                 active_watts=ACTIVE_WATTS, budget=None, shrink=0.5,
+                 grow=1.5):
+        self.floor = floor
+        self.ceiling = max(floor, ceiling)
+        self.active_watts = active_watts
+        self.budget = budget
+        self.shrink = shrink
+        self.grow = grow
+        self.interval = floor
+        self.active = False
+        self._total = None
+        self._devices = None
+        # (time, api_calls) at every poll in the last BUDGET_PERIOD
+        self._calls = deque()
+
+    def observe(self, total, devices):
+        """ total is the power in watts, devices the {id: w} of the devices
+            that are on, from the latest realtime update"""
+        active = False
+        if self._total is not None:
+            active = abs(total - self._total) >= self.active_watts or \
+                set(devices) != set(self._devices) or \
+                any(abs(w - self._devices[sID]) >= self.active_watts
+                    for sID, w in devices.items())
+        self._total = total
+        self._devices = dict(devices)
+        self.active = active
+        return active
+
+    def calls_per_hour(self):
+        """ API calls made during the last BUDGET_PERIOD seconds"""
+        if len(self._calls) < 2:
+            return 0
+        return self._calls[-1][1] - self._calls[0][1]
+
+    def _count_calls(self, api_calls, now):
+        self._calls.append((now, api_calls))
+        while len(self._calls) > 2 and \
+                now - self._calls[1][0] >= BUDGET_PERIOD:
+            self._calls.popleft()
+
+    def next_interval(self, api_calls=None, now=None):
+        """ Seconds until the next poll. api_calls is a running count of
+            the calls made, such as SenseableBase.api_calls"""
+        now = now or time()
+        # fraction of the budget used
+        over = 0
+        if api_calls is not None:
+            self._count_calls(api_calls, now)
+            if self.budget:
+                over = float(self.calls_per_hour()) / self.budget
+        if self.active and over < 1:
+            interval = self.interval * self.shrink
+        else:
+            interval = self.interval * self.grow
+        if over > 1:
+            interval = max(interval, self.interval * over)
+        self.interval = min(self.ceiling, max(self.floor, interval))
+        return self.interval
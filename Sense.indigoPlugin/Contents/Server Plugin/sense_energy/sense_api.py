@@ -1,8 +1,13 @@
 import json
+import re
 import sys
+import threading
 from time import time
 from datetime import datetime
 
+from .aggregate import RealtimeAggregator
+from .realtime import EMPTY_SNAPSHOT, RealtimeSnapshot
+from .records import RealtimeSample, TrendSnapshot
 from .sense_exceptions import *
 
 API_URL = 'https://api.sense.com/apiservice/api/v1/'
@@ -14,6 +19,61 @@ RATE_LIMIT = 30
 # for the last hour, day, week, month, or year
 valid_scales = ['HOUR', 'DAY', 'WEEK', 'MONTH', 'YEAR']
 
+# seconds each scale's trend data is kept before it is fetched again
+TREND_TTL = {
+    'HOUR': 60,
+    'DAY': 60,
+    'WEEK': 600,
+    'MONTH': 1800,
+    'YEAR': 3600
+}
+
+# scales whose totals include another one, WEEK and MONTH add today's
+TREND_ROLLUP = {'WEEK': 'DAY', 'MONTH': 'DAY', 'YEAR': 'MONTH'}
+
+# faster JSON backends, tried in order before falling back to the stdlib
+JSON_BACKENDS = ['orjson', 'ujson', 'simdjson']
+
+# realtime message types the streams act on, None means not classified
+STREAM_TYPES = (None, 'realtime_update', 'error')
+
+# realtime messages carry "type" either first or last in the top-level object
+_TYPE_HEAD = re.compile(r'\{\s*"type"\s*:\s*"([^"]*)"')
+_TYPE_TAIL = re.compile(r'"type"\s*:\s*"([^"]*)"\s*\}\s*$')
+
+
+def _find_json_decoder():
+    for name in JSON_BACKENDS:
+        try:
+            return __import__(name).loads
+        except (ImportError, AttributeError):
+            pass
+    return json.loads
+
+_json_decoder = _find_json_decoder()
+
+
+def set_json_decoder(decoder=None):
+    """ Replaces the function used to parse realtime messages,
+        None picks the fastest installed backend again"""
+    global _json_decoder
+    _json_decoder = decoder or _find_json_decoder()
+
+
+def decode_json(message):
+    return _json_decoder(message)
+
+
+def message_type(message):
+    """ Type of a realtime message, read without parsing the payload.
+        Returns None when it can't be found cheaply"""
+    head, tail = message[:64], message[-64:]
+    if isinstance(message, bytes) and not isinstance(message, str):
+        head = head.decode('utf-8', 'ignore')
+        tail = tail.decode('utf-8', 'ignore')
+    match = _TYPE_HEAD.match(head) or _TYPE_TAIL.search(tail)
+    return match.group(1) if match else None
+
 
 class SenseableBase(object):
 
@@ -25,9 +85,28 @@ class SenseableBase(object):
         self.wss_timeout = wss_timeout
         
         self._realtime = {}
+        self._snapshot = EMPTY_SNAPSHOT
+        self._snapshots = {}
+        self.sense_monitors = []
+        self._aggregation_window = None
+        self._aggregating = False
+        self._aggregators = {}
+        # requests made to the API, logins included
+        self.api_calls = 0
+        # counts realtime updates from every monitor, see wait_realtime
+        self.realtime_updates = 0
+        self._realtime_updated = threading.Condition()
         self._devices = []
         self._trend_data = {}        
         for scale in valid_scales: self._trend_data[scale] = {}
+        self._trend_fetched = dict.fromkeys(valid_scales, 0)
+        self._trends = dict((scale, TrendSnapshot(scale))
+                            for scale in valid_scales)
+        self._trend_lock = threading.Lock()
+        self.trend_ttl = dict(TREND_TTL)
+        # fetch a stale scale when its usage/production is read
+        self.lazy_trends = False
+        self.trend_error = None
 
         if username and password:
             self.authenticate(username, password)
@@ -35,11 +114,15 @@ class SenseableBase(object):
     def set_auth_data(self, data):
         self.sense_access_token = data['access_token']
         self.sense_user_id = data['user_id']
-        self.sense_monitor_id = data['monitors'][0]['id']
+        # every monitor on the account, the first one is the primary
+        self.sense_monitors = [m['id'] for m in data['monitors']]
+        self.sense_monitor_id = self.sense_monitors[0]
 
-        # create the auth header
-        self.headers = {'Authorization': 'bearer {}'.format(
-            self.sense_access_token)}
+        # update the auth header in place, so anything holding it sees the new token
+        if getattr(self, 'headers', None) is None:
+            self.headers = {}
+        self.headers['Authorization'] = 'bearer {}'.format(
+            self.sense_access_token)
         
 
     @property
@@ -47,28 +130,93 @@ class SenseableBase(object):
         """Return devices."""
         return self._devices
     
-    def set_realtime(self, data):
-        self._realtime = data
-        self.last_realtime_call = time()
+    def set_realtime(self, data, monitor_id=None):
+        now = time()
+        primary = getattr(self, 'sense_monitor_id', None)
+        if monitor_id is None:
+            monitor_id = primary
+        previous = self._snapshots.get(monitor_id, EMPTY_SNAPSHOT)
+        snapshot = RealtimeSnapshot(previous.seq + 1, now, data,
+                                    RealtimeSample.from_json(data))
+        self._snapshots[monitor_id] = snapshot
+        if monitor_id == primary:
+            self._realtime = data
+            self.last_realtime_call = now
+            self._snapshot = snapshot
+        aggregator = self.get_aggregator(monitor_id)
+        if aggregator:
+            aggregator.add(data, now)
+        with self._realtime_updated:
+            self.realtime_updates += 1
+            self._realtime_updated.notify_all()
+
+    def wait_realtime(self, seen=0, timeout=None):
+        """ Blocks until there are more realtime_updates than seen, or
+            timeout seconds pass, and returns realtime_updates. Updates
+            arriving while the caller was busy are all answered by one
+            return, the caller reads the latest snapshots"""
+        with self._realtime_updated:
+            if self.realtime_updates <= seen:
+                self._realtime_updated.wait(timeout)
+            return self.realtime_updates
+
+    def enable_aggregation(self, window=None):
+        """ Aggregates every realtime update instead of keeping only the
+            latest, one RealtimeAggregator per monitor"""
+        self._aggregation_window = window
+        self._aggregating = True
+        for aggregator in list(self._aggregators.values()):
+            aggregator.window = window
+        return self.aggregator
+
+    def disable_aggregation(self):
+        self._aggregating = False
+        self._aggregators = {}
+
+    def get_aggregator(self, monitor_id=None):
+        if not self._aggregating:
+            return None
+        if monitor_id is None:
+            monitor_id = getattr(self, 'sense_monitor_id', None)
+        aggregator = self._aggregators.get(monitor_id)
+        if aggregator is None:
+            # setdefault, the reader threads may get here at the same time
+            aggregator = self._aggregators.setdefault(
+                monitor_id, RealtimeAggregator(self._aggregation_window))
+        return aggregator
+
+    @property
+    def aggregator(self):
+        """ The primary monitor's RealtimeAggregator, None unless
+            aggregation is enabled"""
+        return self.get_aggregator()
         
     def get_realtime(self):
         return self._realtime     
 
+    def get_realtime_snapshot(self, monitor_id=None):
+        """ Latest realtime update with its sequence number and receive
+            time, safe to call from any thread without blocking. Defaults
+            to the primary monitor"""
+        if monitor_id is None:
+            return self._snapshot
+        return self._snapshots.get(monitor_id, EMPTY_SNAPSHOT)
+
     @property
     def active_power(self):
-        return self._realtime.get('w', 0)
+        return self._snapshot.sample.w
 
     @property
     def active_solar_power(self):
-        return self._realtime.get('solar_w', 0)
+        return self._snapshot.sample.solar_w
 
     @property
     def active_voltage(self):
-        return self._realtime.get('voltage', 0)
+        return self._snapshot.sample.voltage
     
     @property
     def active_frequency(self):
-        return self._realtime.get('hz', 0)
+        return self._snapshot.sample.hz
     
     @property
     def daily_usage(self):
@@ -112,16 +260,48 @@ class SenseableBase(object):
     def active_devices(self):
         return [d['name'] for d in self._realtime.get('devices', {})]
 
+    def set_trend_data(self, scale, data):
+        with self._trend_lock:
+            self._trend_data[scale] = data
+            self._trend_fetched[scale] = time()
+            self._rollup_trends()
+
+    def _rollup_trends(self):
+        # valid_scales is ordered so every rolled up scale comes first
+        for scale in valid_scales:
+            data = self._trend_data[scale]
+            totals = []
+            for key in ('consumption', 'production'):
+                if key not in data:
+                    totals.append(0)
+                    continue
+                total = data[key].get('total', 0)
+                if scale in TREND_ROLLUP:
+                    total += getattr(self._trends[TREND_ROLLUP[scale]], key)
+                totals.append(total)
+            self._trends[scale] = TrendSnapshot(
+                scale, totals[0], totals[1], self._trend_fetched[scale])
+
+    def get_trend_snapshot(self, scale):
+        return self._trends[scale]
+
+    def trend_is_stale(self, scale):
+        return self._trend_fetched[scale] + self.trend_ttl.get(scale, 0) \
+            <= time()
+
+    def stale_trend_scales(self):
+        return [scale for scale in valid_scales if self.trend_is_stale(scale)]
+
+    def refresh_stale_trend(self, scale):
+        """ Called before reading a scale when lazy_trends is set,
+            clients that can fetch synchronously override it"""
+        pass
+
     def get_trend(self, scale, is_production):
-        if is_production:
-        	key = "production"
-        else:
-        	key = "consumption"
-        if key not in self._trend_data[scale]:
-        	return 0
-        total = self._trend_data[scale][key].get('total', 0)
-        if scale == 'WEEK' or scale == 'MONTH':
-            return total + self.get_trend('DAY', is_production)
-        if scale == 'YEAR':
-            return total + self.get_trend('MONTH', is_production)
-        return total
+        if self.lazy_trends:
+            rolled_up = scale
+            while rolled_up:
+                if self.trend_is_stale(rolled_up):
+                    self.refresh_stale_trend(rolled_up)
+                rolled_up = TREND_ROLLUP.get(rolled_up)
+        return self._trends[scale].total(is_production)
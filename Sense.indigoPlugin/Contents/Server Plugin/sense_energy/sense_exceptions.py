@@ -1,8 +1,11 @@
 
-class SenseAPITimeoutException(Exception):
+class SenseAPIException(Exception):
     pass
 
-class SenseAuthenticationException(Exception):
+class SenseAPITimeoutException(SenseAPIException):
+    pass
+
+class SenseAuthenticationException(SenseAPIException):
     pass
 
 class SenseWebsocketException(Exception):
@@ -1,43 +1,164 @@
 import json
+import threading
 import requests
-from requests.exceptions import ReadTimeout
+from requests.adapters import HTTPAdapter
+from requests.exceptions import ReadTimeout, RequestException
+try:
+    from requests.packages.urllib3.util.retry import Retry
+except ImportError:
+    from urllib3.util.retry import Retry
 from websocket import create_connection
 from websocket._exceptions import WebSocketTimeoutException
 
+from .catalog import DeviceCatalog
+from .history import RateBudget, next_period, period_start, \
+    period_starts, trend_record
+from .realtime import RealtimeReader
+from .records import Device
+from .response_cache import ResponseCache
 from .sense_api import *
 from .sense_exceptions import *
 
+# threads used to fetch trend scales concurrently, 1 fetches them in turn
+TREND_WORKERS = 3
+# retries for requests that couldn't connect, reads are never retried so a
+# slow API still times out after api_timeout
+API_RETRIES = 2
+API_RETRY_BACKOFF = 0.5
+
+
+def run_parallel(func, items, workers):
+    """ Calls func on every item from at most workers threads and waits
+        for all of them. Returns {item: exception} for the calls that
+        failed, a failure never stops the other items"""
+    pending = iter(list(items))
+    errors = {}
+    lock = threading.Lock()
+
+    def worker():
+        while True:
+            with lock:
+                item = next(pending, None)
+            if item is None:
+                return
+            try:
+                func(item)
+            except Exception as e:
+                with lock:
+                    errors[item] = e
+
+    threads = [threading.Thread(target=worker) for _ in range(workers)]
+    for t in threads:
+        t.daemon = True
+        t.start()
+    for t in threads:
+        t.join()
+    return errors
+
+
 class Senseable(SenseableBase):
 
-    def authenticate(self, username, password, rateLimit):
+    def __init__(self, *args, **kwargs):
+        # one realtime reader and device catalog per monitor
+        self._readers = {}
+        self._catalogs = {}
+        self._auth_lock = threading.Lock()
+        self.s = None
+        self.trend_workers = TREND_WORKERS
+        # None disables conditional requests
+        self.response_cache = ResponseCache()
+        super(Senseable, self).__init__(*args, **kwargs)
+
+    def authenticate(self, username, password, rateLimit, token_cache=None):
+        """ Logs in to Sense. With a TokenCache, a cached token for the
+            same user is reused and Sense is only asked for a new one
+            once it expires or gets refused"""
+        self._credentials = (username, password)
+        self.rate_limit = int(rateLimit)
+        self.token_cache = token_cache
+
+        # Keep the session, and its warm connections, across logins
+        if self.s is None:
+            self.s = self.create_session()
+
+        old_token = getattr(self, 'sense_access_token', None)
+        cached = token_cache.load(username) if token_cache else None
+        if cached:
+            self.set_auth_data(cached)
+        else:
+            self._login()
+
+        # a running realtime stream still holds the old token
+        if self.realtime_running and self.sense_access_token != old_token:
+            self.stop_realtime()
+            self.start_realtime()
+        
+        return "Rate limit is: {}".format(self.rate_limit)
+
+    def create_session(self):
+        """ requests session with a connection pool large enough for the
+            trend workers and retries for failed connections"""
+        retry_options = dict(total=API_RETRIES, connect=API_RETRIES,
+                             read=False, backoff_factor=API_RETRY_BACKOFF)
+        try:
+            retries = Retry(allowed_methods=frozenset(['GET']),
+                            **retry_options)
+        except TypeError:
+            # urllib3 before 1.26
+            retries = Retry(method_whitelist=frozenset(['GET']),
+                            **retry_options)
+        adapter = HTTPAdapter(pool_connections=1,
+                              pool_maxsize=self.trend_workers + 1,
+                              max_retries=retries)
+        session = requests.session()
+        session.mount('https://', adapter)
+        return session
+
+    def reauthenticate(self):
+        """ Fetches a new access token with the last credentials, used when
+            Sense refuses the current one"""
+        # every monitor's reader may get refused at once, log in only once
+        token = self.sense_access_token
+        with self._auth_lock:
+            if self.sense_access_token == token:
+                self._login()
+
+    def _login(self):
+        username, password = self._credentials
         auth_data = {
             "email": username,
             "password": password
         }
-        self.rate_limit = int(rateLimit)
-
-        # Create session
-        self.s = requests.session()
 
         # Get auth token
+        self.api_calls += 1
         try:
             response = self.s.post(API_URL+'authenticate',
                                    auth_data, timeout=self.api_timeout)
         except Exception as e:
-            raise Exception('Connection failure: %s' % e)
+            raise SenseAPIException('Connection failure: %s' % e)
 
         # check for 200 return
         if response.status_code != 200:
+            if self.token_cache:
+                self.token_cache.clear()
             raise SenseAuthenticationException(
                 "Please check username and password. API Return Code: %s" %
                 response.status_code)
         
-        self.set_auth_data(response.json())
-        
-        return "Rate limit is: {}".format(self.rate_limit)
+        data = response.json()
+        self.set_auth_data(data)
+        if self.token_cache:
+            try:
+                self.token_cache.save(username, data)
+            except (IOError, OSError):
+                pass
     
     # Update the realtime data 
     def update_realtime(self):
+        # the persistent stream keeps _realtime current by itself
+        if self.realtime_running:
+            return self._realtime
         # rate limit API calls
         if self._realtime and self.rate_limit and \
            self.last_realtime_call + self.rate_limit > time():
@@ -45,22 +166,70 @@ class Senseable(SenseableBase):
         url = WS_URL % (self.sense_monitor_id, self.sense_access_token)
         next(self.get_realtime_stream())
     
+    def start_realtime(self, monitor_ids=None):
+        """ Opens a persistent realtime websocket for every monitor (or
+            those in monitor_ids), each read by a background thread, so
+            update_realtime only returns the latest data"""
+        for monitor_id in monitor_ids or self.sense_monitors:
+            reader = self._readers.get(monitor_id)
+            if reader is not None and reader.running:
+                continue
+            reader = RealtimeReader(self, monitor_id)
+            self._readers[monitor_id] = reader
+            reader.start()
+
+    def stop_realtime(self, timeout=None):
+        readers = list(self._readers.values())
+        self._readers = {}
+        for reader in readers:
+            reader.stop(timeout)
+
+    @property
+    def realtime_running(self):
+        return any(reader.running for reader in self._readers.values())
+
+    def get_realtime_state(self, monitor_id=None):
+        """ stopped, connecting, connected or backoff"""
+        reader = self._readers.get(monitor_id or self.sense_monitor_id)
+        if reader is None:
+            return 'stopped'
+        return reader.state
+
+    @property
+    def realtime_state(self):
+        return self.get_realtime_state()
+
+    @property
+    def realtime_age(self):
+        """ Seconds since the last realtime update, None before the first"""
+        if not self._snapshot.seq:
+            return None
+        return self._snapshot.age
+
     def getRealtimeCall(self):
         return self.last_realtime_call
     
-    def get_realtime_stream(self):
+    def get_realtime_stream(self, monitor_id=None):
         """ Reads realtime data from websocket
             Continues until loop broken"""
         ws = 0
-        url = WS_URL % (self.sense_monitor_id, self.sense_access_token)
+        monitor_id = monitor_id or self.sense_monitor_id
+        url = WS_URL % (monitor_id, self.sense_access_token)
         try:
             ws = create_connection(url, timeout=self.wss_timeout)
             while True: # hello, features, [updates,] data
-                result = json.loads(ws.recv())
+                message = ws.recv()
+                # skip hello, features etc. without a full parse
+                if message_type(message) not in STREAM_TYPES:
+                    continue
+                result = decode_json(message)
                 if result.get('type') == 'realtime_update':
                     data = result['payload']
-                    self.set_realtime(data)
+                    self.set_realtime(data, monitor_id)
                     yield data
+                elif result.get('type') == 'error':
+                    data = result['payload']
+                    raise SenseWebsocketException(data['error_reason'])
         except WebSocketTimeoutException:
             raise SenseAPITimeoutException("API websocket timed out")
         finally:
@@ -69,23 +238,87 @@ class Senseable(SenseableBase):
     def get_trend_data(self, scale):
         if scale.upper() not in valid_scales:
             raise Exception("%s not a valid scale" % scale)
-        t = datetime.now().replace(hour=12)
-        self._trend_data[scale] = self.api_call(
+        # noon today, the same URL all day so the response cache can match it
+        t = datetime.now().replace(hour=12, minute=0, second=0, microsecond=0)
+        self.set_trend_data(scale, self.api_call(
             'app/history/trends?monitor_id=%s&scale=%s&start=%s' %
-            (self.sense_monitor_id, scale, t.isoformat()))
+            (self.sense_monitor_id, scale, t.isoformat())))
 
-    def update_trend_data(self):
-        for scale in valid_scales:
+    def update_trend_data(self, force=False):
+        """ Fetches every scale older than its trend_ttl, or all of
+            them with force, using up to trend_workers requests at once.
+            A failed scale doesn't stop the others, the first failure is
+            raised once they have all finished"""
+        scales = valid_scales if force else self.stale_trend_scales()
+        workers = min(self.trend_workers, len(scales))
+        if workers > 1:
+            errors = run_parallel(self.get_trend_data, scales, workers)
+        else:
+            errors = {}
+            for scale in scales:
+                try:
+                    self.get_trend_data(scale)
+                except Exception as e:
+                    errors[scale] = e
+        if errors:
+            self.trend_error = errors[min(errors, key=scales.index)]
+            raise self.trend_error
+
+    def refresh_stale_trend(self, scale):
+        try:
             self.get_trend_data(scale)
+        except SenseAPIException as e:
+            # keep serving the stale copy, the next read tries again
+            self.trend_error = e
 
-    def api_call(self, url, payload={}):
+    def api_call(self, url, payload={}, cached=True):
+        """ cached=False for one-off requests that would only push
+            reusable responses out of the response cache"""
+        cache = self.response_cache if cached else None
+        key = (url, tuple(sorted(payload.items())))
+        entry = cache.get(key) if cache is not None else None
         try:
-            return self.s.get(API_URL + url,
-                              headers=self.headers,
-                              timeout=self.api_timeout,
-                              data=payload).json()
+            response = self._get(url, payload, entry)
+            if response.status_code == 401:
+                # token expired or revoked, log in again and retry once
+                self.reauthenticate()
+                response = self._get(url, payload, entry)
         except ReadTimeout:
             raise SenseAPITimeoutException("API call timed out")   
+        except RequestException as e:
+            # connection refused, DNS failures etc. once the retries ran out
+            raise SenseAPIException("API call failed: %s" % e)
+        if response.status_code == 304 and entry is not None:
+            # unchanged, skip downloading and decoding the body
+            cache.hits += 1
+            return entry.data
+        if response.status_code == 401:
+            raise SenseAuthenticationException("API call refused after "
+                                               "logging in again")
+        if not response.ok:
+            # error bodies are never cached or handed back as data
+            raise SenseAPIException("API call failed: %s %s" %
+                                    (response.status_code, response.reason))
+        try:
+            data = response.json()
+        except ValueError as e:
+            raise SenseAPIException("API call returned invalid JSON: %s" % e)
+        if cache is not None:
+            cache.put(key, response.headers.get('ETag'),
+                      response.headers.get('Last-Modified'),
+                      data, len(response.content))
+        return data
+
+    def _get(self, url, payload, entry=None):
+        headers = self.headers
+        if entry is not None:
+            headers = dict(headers)
+            headers.update(ResponseCache.validators(entry))
+        self.api_calls += 1
+        return self.s.get(API_URL + url,
+                          headers=headers,
+                          timeout=self.api_timeout,
+                          data=payload)
 
     def get_discovered_device_names(self):
         # lots more info in here to be parsed out
@@ -94,9 +327,27 @@ class Senseable(SenseableBase):
         self._devices = [entry['name'] for entry in json]
         return self._devices
 
-    def get_discovered_device_data(self):
+    def get_discovered_device_data(self, monitor_id=None):
         return self.api_call('monitors/%s/devices' %
-                             self.sense_monitor_id)
+                             (monitor_id or self.sense_monitor_id))
+
+    def get_devices(self, monitor_id=None):
+        """ Discovered devices as Device records"""
+        return [Device.from_json(d)
+                for d in self.get_discovered_device_data(monitor_id)]
+
+    def get_catalog(self, monitor_id=None):
+        """ DeviceCatalog of a monitor, the primary one by default"""
+        monitor_id = monitor_id or self.sense_monitor_id
+        catalog = self._catalogs.get(monitor_id)
+        if catalog is None:
+            catalog = DeviceCatalog(lambda: self.get_devices(monitor_id))
+            self._catalogs[monitor_id] = catalog
+        return catalog
+
+    @property
+    def catalog(self):
+        return self.get_catalog()
 
     def always_on_info(self):
         # Always on info - pretty generic similar to the web page
@@ -119,9 +370,93 @@ class Senseable(SenseableBase):
         return self.api_call('users/%s/notifications' %
                              self.sense_user_id, payload)
 
-    def get_all_usage_data(self):
-        payload = {'n_items': 30}
+    def get_all_usage_data(self, n_items=30, prior_to_item=None):
         # lots of info in here to be parsed out
-        return self.s.get('users/%s/timeline' % self.sense_user_id)#, payload)
+        url = 'users/%s/timeline?n_items=%s' % (self.sense_user_id, n_items)
+        if prior_to_item:
+            url += '&prior_to_item=%s' % prior_to_item
+        # older pages are only read once, while backfilling
+        return self.api_call(url, cached=not prior_to_item)
+
+    def iter_trend_history(self, scale, start, end, budget=None):
+        """ Yields one trend record per scale period from start to end
+            (dates), oldest first, fetching each period only when the
+            caller asks for it"""
+        budget = budget or RateBudget()
+        for day in period_starts(scale, start, end):
+            budget.wait()
+            t = datetime.combine(day, datetime.min.time()).replace(hour=12)
+            data = self.api_call(
+                'app/history/trends?monitor_id=%s&scale=%s&start=%s' %
+                (self.sense_monitor_id, scale, t.isoformat()), cached=False)
+            yield trend_record(self.sense_monitor_id, scale, day, data)
+
+    def iter_timeline(self, prior_to_item=None, n_items=30, budget=None,
+                      until=None):
+        """ Yields timeline items newest first, a page at a time, starting
+            before prior_to_item (or now). Stops when Sense has no more, or
+            at the first item no newer than until (not yielded)"""
+        budget = budget or RateBudget()
+        while True:
+            budget.wait()
+            page = self.get_all_usage_data(n_items, prior_to_item)
+            items = page.get('items', [])
+            for item in items:
+                if until and item.get('time') <= until:
+                    return
+                yield item
+            if not items or not page.get('more', False):
+                return
+            prior_to_item = items[-1]['time']
 
+    def backfill_trends(self, store, scale, start, end=None, budget=None):
+        """ Copies trend history into a HistoryStore, one record at a time.
+            Resumes after the last period stored by an earlier run.
+            Returns the number of records written"""
+        end = end or datetime.now().date()
+        checkpoint = 'trends:%s:%s' % (self.sense_monitor_id, scale)
+        done = store.get_checkpoint(checkpoint)
+        if done:
+            done = datetime.strptime(done, '%Y-%m-%d').date()
+            start = max(start, next_period(scale, done))
+        count = 0
+        current = period_start(scale, datetime.now().date()).isoformat()
+        for record in self.iter_trend_history(scale, start, end, budget):
+            # the current period is still growing, store it but don't
+            # checkpoint past it
+            last = record['start'] >= current
+            store.add_trend(record, None if last else checkpoint)
+            count += 1
+        return count
 
+    def backfill_timeline(self, store, n_items=30, budget=None):
+        """ Copies the timeline into a HistoryStore. Items newer than the
+            last run are fetched first, down to the newest one it stored,
+            then the backfill resumes before the oldest stored item.
+            Returns the number of items written"""
+        checkpoint = 'timeline:%s' % self.sense_user_id
+        newest = checkpoint + ':newest'
+        # a later run's newest item is only checkpointed once everything
+        # down to the previous one is stored, an interrupted run leaves no
+        # gap
+        until = store.get_checkpoint(newest) or store.get_checkpoint(checkpoint)
+        count = 0
+        head = None
+        for item in self.iter_timeline(None, n_items, budget, until):
+            # without a previous run this walk is the backfill itself
+            store.add_timeline_item(self.sense_user_id, item,
+                                    None if until else checkpoint)
+            if head is None:
+                head = item.get('time')
+                if not until:
+                    # and contiguous down to the oldest checkpoint
+                    store.set_checkpoint(newest, head)
+            count += 1
+        if head and until:
+            store.set_checkpoint(newest, head)
+        if until:
+            for item in self.iter_timeline(store.get_checkpoint(checkpoint),
+                                           n_items, budget):
+                store.add_timeline_item(self.sense_user_id, item, checkpoint)
+                count += 1
+        return count
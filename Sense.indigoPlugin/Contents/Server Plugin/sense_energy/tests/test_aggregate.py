@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+#
+
+import sys
+sys.path[0:0] = [""]
+
+import unittest
+
+from sense_energy.aggregate import PowerSummary, RealtimeAggregator
+
+
+def frame(w, **devices):
+    return {'w': w, 'devices': [{'id': k, 'w': v}
+                                for k, v in sorted(devices.items())]}
+
+
+class RealtimeAggregatorTest(unittest.TestCase):
+
+    def testTotals(self):
+        agg = RealtimeAggregator()
+        agg.add(frame(100), 10)
+        agg.add(frame(300), 11)
+        summary = agg.pop()
+        self.assertEqual((summary.start, summary.end, summary.frames),
+                         (10, 11, 2))
+        self.assertEqual(summary.totals['w'], PowerSummary(200, 100, 300, 300))
+        self.assertNotIn('solar_w', summary.totals)
+
+    def testDeviceOffAtEnd(self):
+        agg = RealtimeAggregator()
+        agg.add(frame(0, a=100), 1)
+        agg.add(frame(0, a=300), 2)
+        agg.add(frame(0), 3)
+        agg.add(frame(0), 4)
+        self.assertEqual(agg.pop().devices['a'],
+                         PowerSummary(100, 0, 300, 0))
+
+    def testDeviceOnLate(self):
+        agg = RealtimeAggregator()
+        agg.add(frame(0), 1)
+        agg.add(frame(0, a=50), 2)
+        self.assertEqual(agg.pop().devices['a'], PowerSummary(25, 0, 50, 50))
+
+    def testNegativeDeviceOffPart(self):
+        agg = RealtimeAggregator()
+        agg.add(frame(0, a=-40), 1)
+        agg.add(frame(0), 2)
+        self.assertEqual(agg.pop().devices['a'], PowerSummary(-20, -40, 0, 0))
+
+    def testPopStartsNewWindow(self):
+        agg = RealtimeAggregator()
+        agg.add(frame(100, a=10), 1)
+        agg.pop()
+        summary = agg.peek()
+        self.assertEqual(summary.frames, 0)
+        self.assertEqual(summary.devices, {})
+        agg.add(frame(50), 2)
+        summary = agg.pop()
+        self.assertEqual(summary.totals['w'], PowerSummary(50, 50, 50, 50))
+        self.assertEqual(summary.devices, {})
+
+    def testStaleWindowDropped(self):
+        agg = RealtimeAggregator(window=60)
+        agg.add(frame(1000), 0)
+        agg.add(frame(10), 60)
+        summary = agg.peek()
+        self.assertEqual((summary.start, summary.frames), (60, 1))
+        self.assertEqual(summary.totals['w'].max, 10)
+
+
+if __name__ == "__main__":
+    unittest.main()
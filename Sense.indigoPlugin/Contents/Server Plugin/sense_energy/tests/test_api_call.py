@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+#
+
+import sys
+sys.path[0:0] = [""]
+
+import json
+import unittest
+
+import requests
+
+from sense_energy import Device, Senseable
+from sense_energy.catalog import DeviceCatalog
+from sense_energy.response_cache import ResponseCache
+from sense_energy.sense_exceptions import *
+
+AUTH = {'access_token': 'token', 'user_id': 1, 'monitors': [{'id': 1}]}
+
+
+def make_response(status, body=b'', headers=None):
+    response = requests.Response()
+    response.status_code = status
+    response.reason = 'Reason'
+    response._content = body
+    response.headers.update(headers or {})
+    return response
+
+
+class StubSession(object):
+    """ Answers GETs from a list of responses, recording the headers"""
+
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.requests = []
+
+    def get(self, url, headers=None, timeout=None, data=None):
+        self.requests.append((url, dict(headers or {})))
+        response = self.responses.pop(0)
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+
+class ApiCallTestBase(unittest.TestCase):
+
+    def make_sense(self, *responses):
+        sense = Senseable()
+        sense.set_auth_data(AUTH)
+        sense.s = StubSession(*responses)
+        return sense
+
+
+class ApiErrorTest(ApiCallTestBase):
+
+    def testHtmlErrorBody(self):
+        sense = self.make_sense(make_response(503, b'<html>down</html>'))
+        self.assertRaises(SenseAPIException, sense.api_call, 'x')
+
+    def testInvalidJson(self):
+        sense = self.make_sense(make_response(200, b'<html>'))
+        self.assertRaises(SenseAPIException, sense.api_call, 'x')
+
+    def testConnectionError(self):
+        sense = self.make_sense(requests.ConnectionError('refused'))
+        self.assertRaises(SenseAPIException, sense.api_call, 'x')
+
+    def testErrorNotStoredAsTrend(self):
+        error = json.dumps({'status': 'error'}).encode()
+        sense = self.make_sense(make_response(429, error, {'ETag': '"a"'}))
+        sense.lazy_trends = True
+        self.assertEqual(sense.daily_usage, 0)
+        self.assertIsInstance(sense.trend_error, SenseAPIException)
+        # still stale, the next read tries again
+        self.assertTrue(sense.trend_is_stale('DAY'))
+        self.assertEqual(len(sense.response_cache), 0)
+
+    def testCatalogKeepsDevices(self):
+        error = json.dumps({'status': 'error'}).encode()
+        sense = self.make_sense(make_response(429, error))
+        catalog = DeviceCatalog(sense.get_devices)
+        catalog.devices = [Device('a', 'Kettle')]
+        self.assertEqual(catalog.update(['b']), [Device('a', 'Kettle')])
+        self.assertIsInstance(catalog.last_error, SenseAPIException)
+
+    def testRefusedAfterLogin(self):
+        sense = self.make_sense(make_response(401), make_response(401))
+        sense.reauthenticate = lambda: None
+        self.assertRaises(SenseAuthenticationException, sense.api_call, 'x')
+
+
+class ResponseCacheTest(unittest.TestCase):
+
+    def testEvictsLeastRecentlyUsed(self):
+        cache = ResponseCache(max_bytes=10)
+        cache.put('a', '"a"', None, 'A', 4)
+        cache.put('b', '"b"', None, 'B', 4)
+        cache.get('a')
+        cache.put('c', '"c"', None, 'C', 4)
+        self.assertEqual(cache.get('b'), None)
+        self.assertEqual(cache.get('a').data, 'A')
+        self.assertEqual(cache.size, 8)
+
+    def testTooLarge(self):
+        cache = ResponseCache(max_bytes=10)
+        cache.put('a', '"a"', None, 'A', 11)
+        self.assertEqual(len(cache), 0)
+        self.assertEqual(cache.size, 0)
+
+    def testWithoutValidators(self):
+        cache = ResponseCache()
+        cache.put('a', '"a"', None, 'A', 1)
+        cache.put('a', None, None, 'A', 1)
+        self.assertEqual(cache.get('a'), None)
+        self.assertEqual(cache.size, 0)
+
+
+class ConditionalRequestTest(ApiCallTestBase):
+
+    def testNotModified(self):
+        body = json.dumps([{'id': 'a'}]).encode()
+        sense = self.make_sense(make_response(200, body, {'ETag': '"v1"'}),
+                                make_response(304))
+        first = sense.api_call('devices')
+        second = sense.api_call('devices')
+        self.assertIs(second, first)
+        self.assertEqual(sense.response_cache.hits, 1)
+        self.assertEqual(sense.s.requests[1][1]['If-None-Match'], '"v1"')
+
+    def testChangedResponseReplaced(self):
+        sense = self.make_sense(
+            make_response(200, b'[1]', {'ETag': '"v1"'}),
+            make_response(200, b'[2]', {'ETag': '"v2"'}),
+            make_response(304))
+        sense.api_call('devices')
+        self.assertEqual(sense.api_call('devices'), [2])
+        self.assertEqual(sense.api_call('devices'), [2])
+        self.assertEqual(sense.s.requests[2][1]['If-None-Match'], '"v2"')
+
+    def testNotCached(self):
+        sense = self.make_sense(make_response(200, b'[1]', {'ETag': '"v1"'}),
+                                make_response(200, b'[1]', {'ETag': '"v1"'}))
+        sense.api_call('history', cached=False)
+        sense.api_call('history', cached=False)
+        self.assertEqual(len(sense.response_cache), 0)
+        self.assertNotIn('If-None-Match', sense.s.requests[1][1])
+
+    def testNoValidators(self):
+        sense = self.make_sense(make_response(200, b'[1]'),
+                                make_response(200, b'[1]'))
+        sense.api_call('devices')
+        sense.api_call('devices')
+        self.assertEqual(len(sense.response_cache), 0)
+        self.assertNotIn('If-None-Match', sense.s.requests[1][1])
+
+    def testStableTrendUrl(self):
+        sense = self.make_sense(make_response(200, b'{}'),
+                                make_response(200, b'{}'))
+        sense.get_trend_data('DAY')
+        sense.get_trend_data('DAY')
+        self.assertEqual(sense.s.requests[0][0], sense.s.requests[1][0])
+
+
+if __name__ == "__main__":
+    unittest.main()
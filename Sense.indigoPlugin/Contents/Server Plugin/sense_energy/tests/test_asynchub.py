@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+#
+
+import sys
+sys.path[0:0] = [""]
+
+import asyncio
+import unittest
+
+from sense_energy.asynchub import RealtimeHub
+
+
+class FakeSense(object):
+    """ Streams a realtime update every 10ms until cancelled"""
+
+    def __init__(self):
+        self.streams = 0
+        self.closed = 0
+
+    async def async_realtime_stream(self, callback=None, single=False,
+                                    monitor_id=None):
+        self.streams += 1
+        n = 0
+        try:
+            while True:
+                n += 1
+                callback({'w': n})
+                await asyncio.sleep(0.01)
+        finally:
+            # where the websocket would be closed
+            self.closed += 1
+
+
+class RealtimeHubTest(unittest.TestCase):
+
+    def run_async(self, coro):
+        loop = asyncio.new_event_loop()
+        try:
+            return loop.run_until_complete(coro)
+        finally:
+            loop.close()
+
+    def testResubscribe(self):
+        async def run():
+            sense = FakeSense()
+            hub = RealtimeHub(sense)
+            first = hub.subscribe()
+            await first.__anext__()
+            first.close()
+            # before the cancelled task has finished
+            second = hub.subscribe()
+            self.assertTrue(hub.running)
+            data = await asyncio.wait_for(second.__anext__(), 1)
+            self.assertIn('w', data)
+            self.assertEqual(sense.streams, 2)
+            await hub.stop()
+            self.assertFalse(hub.running)
+        self.run_async(run())
+
+    def testLastUnsubscribeStops(self):
+        async def run():
+            hub = RealtimeHub(FakeSense())
+            subscription = hub.subscribe()
+            await subscription.__anext__()
+            subscription.close()
+            self.assertFalse(hub.running)
+            await asyncio.sleep(0.05)
+        self.run_async(run())
+
+    def testStopClosesStream(self):
+        async def run():
+            sense = FakeSense()
+            hub = RealtimeHub(sense)
+            subscription = hub.subscribe()
+            await subscription.__anext__()
+            await hub.stop()
+            self.assertEqual(sense.closed, 1)
+            self.assertFalse(hub.running)
+        self.run_async(run())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+#
+
+import sys
+sys.path[0:0] = [""]
+
+import unittest
+
+from sense_energy import Deadband
+
+
+class DeadbandTest(unittest.TestCase):
+
+    def testNeverWritten(self):
+        self.assertTrue(Deadband(watts=100).allows(None, None, None))
+        self.assertTrue(Deadband(watts=100).allows(10, 10, None))
+
+    def testWatts(self):
+        deadband = Deadband(watts=10)
+        self.assertFalse(deadband.allows(100, 110, 5))
+        self.assertTrue(deadband.allows(100, 111, 5))
+        self.assertTrue(deadband.allows(100, 89, 5))
+
+    def testPercent(self):
+        deadband = Deadband(percent=10)
+        self.assertFalse(deadband.allows(1000, 1100, 5))
+        self.assertTrue(deadband.allows(1000, 1101, 5))
+        self.assertFalse(deadband.allows(-1000, -1050, 5))
+
+    def testPercentFromZero(self):
+        deadband = Deadband(watts=5, percent=10)
+        self.assertTrue(deadband.allows(0, 6, 5))
+        self.assertFalse(deadband.allows(0, 5, 5))
+
+    def testOnOff(self):
+        deadband = Deadband(watts=1000, percent=50, min_interval=60)
+        self.assertTrue(deadband.allows(None, 1, 5))
+        self.assertTrue(deadband.allows(1, None, 5))
+        self.assertFalse(deadband.allows(None, None, 5))
+
+    def testMinInterval(self):
+        deadband = Deadband(watts=10, min_interval=30)
+        self.assertFalse(deadband.allows(100, 500, 29))
+        self.assertTrue(deadband.allows(100, 500, 30))
+
+    def testHeartbeat(self):
+        deadband = Deadband(watts=1000, heartbeat=600)
+        self.assertFalse(deadband.allows(100, 100, 599))
+        self.assertTrue(deadband.allows(100, 100, 600))
+        self.assertTrue(deadband.allows(None, None, 600))
+        self.assertFalse(Deadband(heartbeat=0).allows(100, 100, 10 ** 6))
+
+    def testOverride(self):
+        deadband = Deadband(10, 5, 30, 600).override(percent=0, heartbeat=0)
+        self.assertEqual((deadband.watts, deadband.percent,
+                          deadband.min_interval, deadband.heartbeat),
+                         (10, 0, 30, 0))
+
+
+if __name__ == "__main__":
+    unittest.main()
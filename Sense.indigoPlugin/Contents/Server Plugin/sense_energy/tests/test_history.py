@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+#
+
+import sys
+sys.path[0:0] = [""]
+
+import unittest
+from datetime import date, datetime, timedelta
+
+from sense_energy import HistoryStore, RateBudget, Senseable
+from sense_energy.history import next_period, period_start, period_starts
+
+
+class Interrupted(Exception):
+    pass
+
+
+class FakeSense(Senseable):
+    """ Serves a timeline (times newest first) and trend data without
+        the API, failing after fail_after requests"""
+
+    def __init__(self, times=()):
+        super(FakeSense, self).__init__()
+        self.sense_user_id = 1
+        self.sense_monitor_id = 1
+        self.times = list(times)
+        self.urls = []
+        self.fail_after = None
+
+    def _request(self, url):
+        if self.fail_after is not None and len(self.urls) >= self.fail_after:
+            raise Interrupted()
+        self.urls.append(url)
+
+    def get_all_usage_data(self, n_items=30, prior_to_item=None):
+        self._request(prior_to_item)
+        older = [t for t in self.times
+                 if prior_to_item is None or t < prior_to_item]
+        return {'items': [{'time': t, 'type': 'x'} for t in older[:n_items]],
+                'more': len(older) > n_items}
+
+    def api_call(self, url, payload={}, cached=True):
+        self._request(url)
+        return {'consumption': {'total': 1}}
+
+
+def timeline(start, end):
+    """ Item times from end down to start"""
+    return ['t%03d' % i for i in range(end, start - 1, -1)]
+
+
+class PeriodTest(unittest.TestCase):
+
+    def testPeriodStart(self):
+        day = date(2020, 3, 18)
+        self.assertEqual(period_start('DAY', day), day)
+        self.assertEqual(period_start('WEEK', day), date(2020, 3, 16))
+        self.assertEqual(period_start('MONTH', day), date(2020, 3, 1))
+        self.assertEqual(period_start('YEAR', day), date(2020, 1, 1))
+        self.assertRaises(Exception, period_start, 'HOUR', day)
+
+    def testNextPeriod(self):
+        self.assertEqual(next_period('MONTH', date(2020, 1, 1)),
+                         date(2020, 2, 1))
+        self.assertEqual(next_period('MONTH', date(2020, 12, 1)),
+                         date(2021, 1, 1))
+        self.assertEqual(next_period('WEEK', date(2020, 3, 16)),
+                         date(2020, 3, 23))
+
+    def testPeriodStarts(self):
+        self.assertEqual(list(period_starts('MONTH', date(2020, 1, 15),
+                                            date(2020, 3, 1))),
+                         [date(2020, 1, 1), date(2020, 2, 1),
+                          date(2020, 3, 1)])
+
+
+class HistoryStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.store = HistoryStore(':memory:')
+
+    def tearDown(self):
+        self.store.close()
+
+    def testCheckpoints(self):
+        self.assertEqual(self.store.get_checkpoint('a'), None)
+        self.store.set_checkpoint('a', 'x')
+        self.assertEqual(self.store.get_checkpoint('a'), 'x')
+
+    def testTrends(self):
+        for day in (date(2020, 1, 2), date(2020, 1, 1)):
+            self.store.add_trend({'monitor_id': 1, 'scale': 'DAY',
+                                  'start': day.isoformat(), 'consumption': 2,
+                                  'production': 0, 'data': {}}, 'cp')
+        self.assertEqual(self.store.get_checkpoint('cp'), '2020-01-01')
+        self.assertEqual([r[0] for r in self.store.trends(1, 'DAY')],
+                         ['2020-01-01', '2020-01-02'])
+        self.assertEqual(
+            list(self.store.trends(1, 'DAY', start=date(2020, 1, 2))),
+            [('2020-01-02', 2, 0)])
+
+    def testRateBudget(self):
+        budget = RateBudget(0)
+        budget.wait()
+        budget.wait()
+        self.assertEqual(budget.calls, 2)
+
+
+class BackfillTrendsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.store = HistoryStore(':memory:')
+        self.budget = RateBudget(0)
+
+    def testResume(self):
+        sense = FakeSense()
+        start = date(2020, 1, 1)
+        end = date(2020, 1, 10)
+        sense.fail_after = 4
+        self.assertRaises(Interrupted, sense.backfill_trends, self.store,
+                          'DAY', start, end, self.budget)
+        sense.fail_after = None
+        sense.urls = []
+        self.assertEqual(sense.backfill_trends(self.store, 'DAY', start, end,
+                                               self.budget), 6)
+        self.assertEqual(len(list(self.store.trends(1, 'DAY'))), 10)
+
+    def testPastEndNotRefetched(self):
+        sense = FakeSense()
+        start = date(2020, 1, 1)
+        end = date(2020, 1, 10)
+        sense.backfill_trends(self.store, 'DAY', start, end, self.budget)
+        sense.urls = []
+        self.assertEqual(sense.backfill_trends(self.store, 'DAY', start, end,
+                                               self.budget), 0)
+
+    def testCurrentPeriodRefetched(self):
+        sense = FakeSense()
+        today = datetime.now().date()
+        start = today - timedelta(days=2)
+        sense.backfill_trends(self.store, 'DAY', start, None, self.budget)
+        self.assertEqual(sense.backfill_trends(self.store, 'DAY', start, None,
+                                               self.budget), 1)
+
+
+class BackfillTimelineTest(unittest.TestCase):
+
+    def setUp(self):
+        self.store = HistoryStore(':memory:')
+        self.budget = RateBudget(0)
+
+    def count(self):
+        return self.store._db.execute(
+            "SELECT COUNT(*) FROM timeline").fetchone()[0]
+
+    def testNewerItems(self):
+        sense = FakeSense(timeline(1, 20))
+        self.assertEqual(sense.backfill_timeline(self.store, 5, self.budget),
+                         20)
+        sense.times = timeline(1, 30)
+        sense.urls = []
+        self.assertEqual(sense.backfill_timeline(self.store, 5, self.budget),
+                         10)
+        self.assertEqual(self.count(), 30)
+        self.assertEqual(self.store.get_checkpoint('timeline:1:newest'),
+                         't030')
+
+    def testInterruptedFirstRun(self):
+        sense = FakeSense(timeline(1, 50))
+        sense.fail_after = 3
+        self.assertRaises(Interrupted, sense.backfill_timeline, self.store, 5,
+                          self.budget)
+        self.assertEqual(self.count(), 15)
+        sense.fail_after = None
+        sense.urls = []
+        self.assertEqual(sense.backfill_timeline(self.store, 5, self.budget),
+                         35)
+        self.assertEqual(self.count(), 50)
+        # one page to find nothing is newer, then only the missing pages
+        self.assertEqual(len(sense.urls), 8)
+
+    def testInterruptedCatchUp(self):
+        sense = FakeSense(timeline(1, 20))
+        sense.backfill_timeline(self.store, 5, self.budget)
+        sense.times = timeline(1, 40)
+        sense.fail_after = 2
+        self.assertRaises(Interrupted, sense.backfill_timeline, self.store, 5,
+                          self.budget)
+        # the newest checkpoint stays put until the catch up completes
+        self.assertEqual(self.store.get_checkpoint('timeline:1:newest'),
+                         't020')
+        sense.fail_after = None
+        sense.backfill_timeline(self.store, 5, self.budget)
+        self.assertEqual(self.count(), 40)
+        self.assertEqual(self.store.get_checkpoint('timeline:1:newest'),
+                         't040')
+
+
+if __name__ == "__main__":
+    unittest.main()
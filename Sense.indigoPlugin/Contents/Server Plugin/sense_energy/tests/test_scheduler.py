@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+#
+
+import sys
+sys.path[0:0] = [""]
+
+import unittest
+
+from sense_energy import PollScheduler
+from sense_energy.scheduler import BUDGET_PERIOD
+
+
+class PollSchedulerTest(unittest.TestCase):
+
+    def testActivityShrinks(self):
+        scheduler = PollScheduler(floor=5, ceiling=120)
+        scheduler.interval = 40
+        scheduler.observe(100, {})
+        scheduler.observe(300, {})
+        self.assertTrue(scheduler.active)
+        self.assertEqual(scheduler.next_interval(), 20)
+        scheduler.observe(300, {})
+        self.assertFalse(scheduler.active)
+        self.assertEqual(scheduler.next_interval(), 30)
+
+    def testDeviceOnOffIsActive(self):
+        scheduler = PollScheduler(active_watts=50)
+        scheduler.observe(100, {'a': 10})
+        self.assertFalse(scheduler.observe(100, {'a': 40}))
+        self.assertTrue(scheduler.observe(100, {}))
+
+    def testClamped(self):
+        scheduler = PollScheduler(floor=5, ceiling=10)
+        for _ in range(5):
+            scheduler.next_interval()
+        self.assertEqual(scheduler.interval, 10)
+        scheduler.observe(0, {})
+        for _ in range(5):
+            scheduler.observe(1000, {})
+            scheduler.observe(0, {})
+            scheduler.next_interval()
+        self.assertEqual(scheduler.interval, 5)
+
+    def testCallsPerHour(self):
+        scheduler = PollScheduler()
+        self.assertEqual(scheduler.calls_per_hour(), 0)
+        scheduler.next_interval(api_calls=10, now=1000)
+        self.assertEqual(scheduler.calls_per_hour(), 0)
+        scheduler.next_interval(api_calls=25, now=1100)
+        scheduler.next_interval(api_calls=40, now=1200)
+        self.assertEqual(scheduler.calls_per_hour(), 30)
+
+    def testOldCallsTrimmed(self):
+        scheduler = PollScheduler()
+        scheduler.next_interval(api_calls=0, now=0)
+        scheduler.next_interval(api_calls=100, now=100)
+        scheduler.next_interval(api_calls=110, now=BUDGET_PERIOD + 100)
+        # the count starts from the last poll over an hour old
+        self.assertEqual(scheduler.calls_per_hour(), 10)
+        self.assertEqual(len(scheduler._calls), 2)
+
+    def testNoShrinkAtBudget(self):
+        scheduler = PollScheduler(floor=5, ceiling=120, budget=10)
+        scheduler.next_interval(api_calls=0, now=0)
+        scheduler.interval = 40
+        scheduler.observe(0, {})
+        scheduler.observe(1000, {})
+        # active, but all of the budget was used, so it grows
+        self.assertEqual(scheduler.next_interval(api_calls=10, now=60), 60)
+
+    def testStretchedOverBudget(self):
+        scheduler = PollScheduler(floor=5, ceiling=1000, budget=10)
+        scheduler.interval = 40
+        scheduler.next_interval(api_calls=0, now=0)
+        scheduler.interval = 40
+        # three times the budget stretches more than growing would
+        self.assertEqual(scheduler.next_interval(api_calls=30, now=60), 120)
+        scheduler.interval = 100
+        self.assertEqual(scheduler.next_interval(api_calls=30, now=120), 300)
+
+    def testStretchClamped(self):
+        scheduler = PollScheduler(floor=5, ceiling=120, budget=10)
+        scheduler.next_interval(api_calls=0, now=0)
+        self.assertEqual(scheduler.next_interval(api_calls=1000, now=60), 120)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,50 @@
+import json
+import os
+from time import time
+
+# seconds a cached token is trusted before logging in again
+TOKEN_MAX_AGE = 24 * 60 * 60
+
+
+class TokenCache(object):
+    """ Keeps the authentication data from Sense in a JSON file, so a
+        restart can reuse the access token instead of logging in again"""
+
+    def __init__(self, path, max_age=TOKEN_MAX_AGE):
+        self.path = path
+        self.max_age = max_age
+
+    def load(self, username):
+        """ Returns the cached auth data for username, or None if there is
+            none or it has expired"""
+        try:
+            with open(self.path) as f:
+                cached = json.load(f)
+        except (IOError, OSError, ValueError):
+            return None
+        if not isinstance(cached, dict) or \
+           cached.get('username') != username or \
+           cached.get('expires', 0) <= time():
+            return None
+        return cached.get('data')
+
+    def save(self, username, data):
+        now = time()
+        cached = {
+            'username': username,
+            'saved': now,
+            'expires': now + self.max_age,
+            'data': data
+        }
+        # the token is a credential, keep it private to the user
+        tmp_path = self.path + '.tmp'
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, 'w') as f:
+            json.dump(cached, f)
+        os.rename(tmp_path, self.path)
+
+    def clear(self):
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
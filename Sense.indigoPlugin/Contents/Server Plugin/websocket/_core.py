@@ -440,6 +440,7 @@ class WebSocket(object):
     def shutdown(self):
         """close socket, immediately."""
         if self.sock:
+            save_ssl_session(self.sock)
             self.sock.close()
             self.sock = None
             self.connected = False
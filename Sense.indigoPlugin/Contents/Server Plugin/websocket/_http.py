@@ -23,6 +23,8 @@ import errno
 import os
 import socket
 import sys
+import threading
+import weakref
 
 import six
 
@@ -37,7 +39,17 @@ if six.PY3:
 else:
     from base64 import encodestring as base64encode
 
-__all__ = ["proxy_info", "connect", "read_headers"]
+__all__ = ["proxy_info", "connect", "read_headers",
+           "save_ssl_session", "clear_ssl_cache"]
+
+HAVE_SSL_SESSION = HAVE_SSL and hasattr(ssl, "SSLSession")
+
+# SSLContexts keyed by their sslopt, building one reloads the CA certificates.
+_ssl_contexts = {}
+# last TLS session per (hostname, port, sslopt) so reconnects can resume it.
+_ssl_sessions = {}
+_ssl_session_keys = weakref.WeakKeyDictionary()
+_ssl_cache_lock = threading.Lock()
 
 try:
     import socks
@@ -203,7 +215,17 @@ def _can_use_sni():
     return six.PY2 and sys.version_info >= (2, 7, 9) or sys.version_info >= (3, 2)
 
 
-def _wrap_sni_socket(sock, sslopt, hostname, check_hostname):
+def _ssl_context_key(sslopt, check_hostname):
+    try:
+        key = (check_hostname, tuple(sorted(sslopt.items())))
+        hash(key)
+        return key
+    except TypeError:
+        # unhashable option, don't cache
+        return None
+
+
+def _create_ssl_context(sslopt, check_hostname):
     context = ssl.SSLContext(sslopt.get('ssl_version', ssl.PROTOCOL_SSLv23))
 
     if sslopt.get('cert_reqs', ssl.CERT_NONE) != ssl.CERT_NONE:
@@ -232,12 +254,80 @@ def _wrap_sni_socket(sock, sslopt, hostname, check_hostname):
     if 'ecdh_curve' in sslopt:
         context.set_ecdh_curve(sslopt['ecdh_curve'])
 
-    return context.wrap_socket(
-        sock,
+    return context
+
+
+def _get_ssl_context(sslopt, check_hostname, key):
+    if key is None:
+        return _create_ssl_context(sslopt, check_hostname)
+    with _ssl_cache_lock:
+        context = _ssl_contexts.get(key)
+        if context is None:
+            context = _create_ssl_context(sslopt, check_hostname)
+            _ssl_contexts[key] = context
+        return context
+
+
+def _peer_port(sock):
+    try:
+        return sock.getpeername()[1]
+    except (socket.error, IndexError, TypeError):
+        return None
+
+
+def save_ssl_session(sock):
+    """
+    Remember the TLS session of sock, so the next connection to the same
+    host can resume it instead of doing a full handshake.
+    TLS 1.3 tickets arrive after the handshake, so call this again
+    before closing the socket.
+    """
+    key = _ssl_session_keys.get(sock)
+    if key is None:
+        return
+    try:
+        session = sock.session
+    except (AttributeError, ValueError):
+        return
+    if session is not None:
+        with _ssl_cache_lock:
+            _ssl_sessions[key] = session
+
+
+def clear_ssl_cache():
+    """
+    Drop cached SSLContexts and TLS sessions, e.g. after the CA
+    certificates changed.
+    """
+    with _ssl_cache_lock:
+        _ssl_contexts.clear()
+        _ssl_sessions.clear()
+
+
+def _wrap_sni_socket(sock, sslopt, hostname, check_hostname):
+    key = _ssl_context_key(sslopt, check_hostname)
+    context = _get_ssl_context(sslopt, check_hostname, key)
+
+    session_key = None
+    session = None
+    if HAVE_SSL_SESSION and key is not None:
+        session_key = (hostname, _peer_port(sock), key)
+        with _ssl_cache_lock:
+            session = _ssl_sessions.get(session_key)
+
+    options = dict(
         do_handshake_on_connect=sslopt.get('do_handshake_on_connect', True),
         suppress_ragged_eofs=sslopt.get('suppress_ragged_eofs', True),
         server_hostname=hostname,
     )
+    if session is not None:
+        options['session'] = session
+    sslsock = context.wrap_socket(sock, **options)
+
+    if session_key is not None:
+        _ssl_session_keys[sslsock] = session_key
+        save_ssl_session(sslsock)
+    return sslsock
 
 
 def _ssl_socket(sock, user_sslopt, hostname):
@@ -6,7 +6,11 @@ sys.path[0:0] = [""]
 
 import os
 import os.path
+import shutil
 import socket
+import subprocess
+import tempfile
+import threading
 
 import six
 
@@ -14,7 +18,8 @@ import six
 import websocket as ws
 from websocket._handshake import _create_sec_websocket_key, \
     _validate as _validate_header
-from websocket._http import read_headers
+from websocket._http import read_headers, _ssl_socket, _ssl_contexts, \
+    save_ssl_session, clear_ssl_cache, HAVE_SSL_SESSION
 from websocket._url import get_proxy_info, parse_url
 from websocket._utils import validate_utf8
 
@@ -555,6 +560,79 @@ class SockOptTest(unittest.TestCase):
         s.close()
 
 
+def _find_openssl():
+    for path in os.environ.get("PATH", "").split(os.pathsep):
+        if os.path.isfile(os.path.join(path, "openssl")):
+            return True
+    return False
+
+
+@unittest.skipUnless(ws._http.HAVE_SSL and _find_openssl(), "openssl is needed to create a test certificate")
+class SSLCacheTest(unittest.TestCase):
+    def setUp(self):
+        import ssl
+        self.tmpdir = tempfile.mkdtemp()
+        self.certfile = os.path.join(self.tmpdir, "cert.pem")
+        keyfile = os.path.join(self.tmpdir, "key.pem")
+        with open(os.devnull, "w") as devnull:
+            subprocess.check_call(
+                ["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes",
+                 "-keyout", keyfile, "-out", self.certfile, "-days", "1",
+                 "-subj", "/CN=localhost",
+                 "-addext", "subjectAltName=DNS:localhost"],
+                stdout=devnull, stderr=devnull)
+        self.server_context = ssl.SSLContext(ssl.PROTOCOL_SSLv23)
+        self.server_context.load_cert_chain(self.certfile, keyfile)
+        self.server = socket.socket()
+        self.server.bind(("127.0.0.1", 0))
+        self.server.listen(5)
+        self.thread = threading.Thread(target=self._serve)
+        self.thread.daemon = True
+        self.thread.start()
+        clear_ssl_cache()
+
+    def tearDown(self):
+        self.server.close()
+        shutil.rmtree(self.tmpdir)
+        clear_ssl_cache()
+
+    def _serve(self):
+        while True:
+            try:
+                conn, _ = self.server.accept()
+            except socket.error:
+                return
+            try:
+                conn = self.server_context.wrap_socket(conn, server_side=True)
+                conn.sendall(six.b("x"))
+                conn.recv(1)
+            except Exception:
+                pass
+            conn.close()
+
+    def _connect(self):
+        sock = socket.create_connection(self.server.getsockname())
+        sock = _ssl_socket(sock, {"ca_certs": self.certfile}, "localhost")
+        # reading lets TLS 1.3 session tickets arrive
+        self.assertEqual(sock.recv(1), six.b("x"))
+        save_ssl_session(sock)
+        reused = sock.session_reused
+        sock.close()
+        return reused
+
+    def testContextIsCached(self):
+        self._connect()
+        self._connect()
+        self.assertEqual(len(_ssl_contexts), 1)
+        clear_ssl_cache()
+        self.assertEqual(len(_ssl_contexts), 0)
+
+    @unittest.skipUnless(HAVE_SSL_SESSION, "TLS session resumption needs Python 3.6+")
+    def testSessionIsResumed(self):
+        self.assertFalse(self._connect())
+        self.assertTrue(self._connect())
+
+
 class UtilsTest(unittest.TestCase):
     def testUtf8Validator(self):
         state = validate_utf8(six.b('\xf0\x90\x80\x80'))